@@ -0,0 +1,86 @@
+#! /usr/bin/python3
+
+# (de-)serialization of ACL dumps as used by importacls/exportacls and the
+# http-server
+#
+# acls are (who, command) tuples, groups are (group_name, who) tuples
+
+import csv
+import io
+import json
+
+
+formats = ('json', 'csv')
+
+def format_from_name(name):
+    dot = name.rfind('.')
+
+    if dot == -1:
+        return None
+
+    fmt = name[dot + 1:].lower()
+
+    return fmt if fmt in formats else None
+
+def to_json(acls, groups):
+    out = dict()
+    out['acls']       = [{ 'who': who, 'command': command } for who, command in acls]
+    out['acl_groups'] = [{ 'group_name': group_name, 'who': who } for group_name, who in groups]
+
+    return json.dumps(out, indent=1)
+
+def from_json(text):
+    data = json.loads(text)
+
+    acls   = [(row['who'], row['command']) for row in data.get('acls', [])]
+    groups = [(row['group_name'], row['who']) for row in data.get('acl_groups', [])]
+
+    return acls, groups
+
+# one row per line: acl,<who>,<command> or group,<group_name>,<who>
+def to_csv(acls, groups):
+    buffer = io.StringIO()
+
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    for who, command in acls:
+        writer.writerow(('acl', who, command))
+
+    for group_name, who in groups:
+        writer.writerow(('group', group_name, who))
+
+    return buffer.getvalue()
+
+def from_csv(text):
+    acls   = []
+    groups = []
+
+    for row in csv.reader(io.StringIO(text)):
+        if len(row) == 0 or row[0].startswith('#'):
+            continue
+
+        if len(row) != 3:
+            raise ValueError(f'invalid csv row {row}')
+
+        if row[0] == 'acl':
+            acls.append((row[1], row[2]))
+
+        elif row[0] == 'group':
+            groups.append((row[1], row[2]))
+
+        else:
+            raise ValueError(f'invalid row type "{row[0]}"')
+
+    return acls, groups
+
+def dump(acls, groups, fmt):
+    if fmt == 'csv':
+        return to_csv(acls, groups)
+
+    return to_json(acls, groups)
+
+def parse(text, fmt):
+    if fmt == 'csv':
+        return from_csv(text)
+
+    return from_json(text)
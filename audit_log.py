@@ -0,0 +1,102 @@
+#! /usr/bin/python3
+
+import collections
+import json
+import threading
+import time
+
+
+# records ACL decisions and admin mutations; record() only appends to a
+# bounded in-memory queue, a background thread writes batches of them to the
+# audit_log table (or to a file) so that a slow database does not slow down
+# command processing
+class audit_log(threading.Thread):
+    drop_policies = ('drop-newest', 'drop-oldest')
+
+    def __init__(self, db, filename, queue_size, batch_size, drop_policy):
+        super().__init__()
+
+        if not drop_policy in audit_log.drop_policies:
+            raise ValueError(f'audit_log: drop policy must be one of {", ".join(audit_log.drop_policies)}')
+
+        self.db          = db        # dbi instance, used when filename is None
+        self.filename    = filename
+
+        self.queue_size  = queue_size
+        self.batch_size  = batch_size
+        self.drop_policy = drop_policy
+
+        self.queue       = collections.deque()
+        self.cond        = threading.Condition()
+
+        self.n_queued    = 0
+        self.n_written   = 0
+        self.n_dropped   = 0
+
+        self.name = 'GHBot audit'
+        self.start()
+
+    # kind is 'acl' (access decision) or 'admin' (mutation)
+    def record(self, kind, actor, action, target, result):
+        entry = (time.strftime('%Y-%m-%d %H:%M:%S'), kind, actor, action, target, result)
+
+        with self.cond:
+            if len(self.queue) >= self.queue_size:
+                self.n_dropped += 1
+
+                if self.drop_policy == 'drop-newest':
+                    return
+
+                self.queue.popleft()
+
+            self.queue.append(entry)
+
+            self.n_queued += 1
+
+            self.cond.notify()
+
+    def get_counters(self):
+        with self.cond:
+            return { 'queued': self.n_queued, 'written': self.n_written, 'dropped': self.n_dropped, 'pending': len(self.queue) }
+
+    def _write(self, batch):
+        if self.filename != None:
+            with open(self.filename, 'a') as fh:
+                for entry in batch:
+                    fh.write(json.dumps(entry) + '\n')
+
+        else:
+            with self.db.lock:
+                self.db.probe()
+
+                with self.db.db.cursor() as cursor:
+                    cursor.executemany('INSERT INTO audit_log(ts, kind, actor, action, target, result) VALUES(%s, %s, %s, %s, %s, %s)', batch)
+
+                    self.db.db.commit()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while len(self.queue) == 0:
+                    self.cond.wait()
+
+                batch = [self.queue.popleft() for i in range(min(self.batch_size, len(self.queue)))]
+
+            try:
+                self._write(batch)
+
+                with self.cond:
+                    self.n_written += len(batch)
+
+            except Exception as e:
+                print(f'audit_log::run: failed to write {len(batch)} entries: {e}')
+
+                # put them back (oldest first) as far as there's room
+                with self.cond:
+                    room = max(self.queue_size - len(self.queue), 0)
+
+                    self.n_dropped += len(batch) - min(room, len(batch))
+
+                    self.queue.extendleft(reversed(batch[0:room]))
+
+                time.sleep(1)
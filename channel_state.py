@@ -0,0 +1,163 @@
+#! /usr/bin/python3
+
+import json
+import threading
+import time
+
+
+# keeps track of topic, members and modes of each channel and publishes them
+# to the broker:
+# - from/irc/<channel>/state: the full state, retained so that a plugin gets
+#   it right after subscribing; refreshed periodically
+# - from/irc/<channel>/state/delta: the changes (join, part, kick, quit,
+#   nick, topic, mode), not retained
+# both carry a version that increases with every change so that a plugin can
+# detect that it missed a delta (and then wait for the next full state).
+# it is updated from the IRC reader thread, so publishing never waits for
+# the broker: when the publish queue is full the message is dropped and a
+# plugin notices the gap in the versions.
+class channel_state(threading.Thread):
+    # modes with a parameter that is not a property of the channel itself
+    member_modes = 'ovhbeIqa'
+
+    def __init__(self, mqtt, refresh_interval):
+        super().__init__()
+
+        self.mqtt             = mqtt
+        self.refresh_interval = refresh_interval
+
+        self.channels         = dict()  # channel (without '#') -> state dict
+        self.lock             = threading.Lock()
+
+        self.name = 'GHBot channel state'
+        self.start()
+
+    def _get(self, channel):
+        state = self.channels.get(channel)
+
+        if state == None:
+            state = { 'version': 0, 'topic': '', 'members': dict(), 'modes': set() }
+
+            self.channels[channel] = state
+
+        return state
+
+    # invoked with lock held
+    def _delta(self, channel, state, op, **data):
+        state['version'] += 1
+
+        data['op']      = op
+        data['version'] = state['version']
+
+        self.mqtt.publish(f'from/irc/{channel}/state/delta', json.dumps(data), block=False)
+
+    # invoked with lock held
+    def _full(self, channel, state):
+        out = dict()
+        out['version'] = state['version']
+        out['topic']   = state['topic']
+        out['members'] = sorted(state['members'].values(), key=lambda n: n.lower())
+        out['modes']   = '+' + ''.join(sorted(state['modes']))
+        out['ts']      = time.time()
+
+        self.mqtt.publish(f'from/irc/{channel}/state', json.dumps(out), persistent=True, block=False)
+
+    def reset(self, channel):
+        with self.lock:
+            state = self._get(channel)
+
+            state['members'] = dict()
+
+    # 353; only members, no delta as the full state follows at the end (366)
+    def names(self, channel, nicks):
+        with self.lock:
+            state = self._get(channel)
+
+            for nick in nicks:
+                nick = nick.lstrip('@+%~&')
+
+                if nick != '':
+                    state['members'][nick.lower()] = nick
+
+    def names_end(self, channel):
+        with self.lock:
+            state = self._get(channel)
+
+            state['version'] += 1
+
+            self._full(channel, state)
+
+    def join(self, channel, nick):
+        with self.lock:
+            state = self._get(channel)
+
+            state['members'][nick.lower()] = nick
+
+            self._delta(channel, state, 'join', nick=nick)
+
+    def part(self, channel, nick, op='part'):
+        with self.lock:
+            state = self._get(channel)
+
+            if state['members'].pop(nick.lower(), None) != None:
+                self._delta(channel, state, op, nick=nick)
+
+    def quit(self, nick):
+        with self.lock:
+            for channel, state in self.channels.items():
+                if state['members'].pop(nick.lower(), None) != None:
+                    self._delta(channel, state, 'quit', nick=nick)
+
+    def nick(self, old_nick, new_nick):
+        with self.lock:
+            for channel, state in self.channels.items():
+                if state['members'].pop(old_nick.lower(), None) != None:
+                    state['members'][new_nick.lower()] = new_nick
+
+                    self._delta(channel, state, 'nick', old=old_nick, new=new_nick)
+
+    def topic(self, channel, text):
+        with self.lock:
+            state = self._get(channel)
+
+            if state['topic'] != text:
+                state['topic'] = text
+
+                self._delta(channel, state, 'topic', topic=text)
+
+    # e.g. '+nt-s'; from 324 (replace=True) or MODE
+    def modes(self, channel, mode_str, replace=False):
+        with self.lock:
+            state = self._get(channel)
+
+            modes = set() if replace else set(state['modes'])
+
+            add   = True
+
+            for c in mode_str:
+                if c == '+' or c == '-':
+                    add = c == '+'
+
+                elif not c in channel_state.member_modes:
+                    if add:
+                        modes.add(c)
+
+                    else:
+                        modes.discard(c)
+
+            if modes != state['modes']:
+                state['modes'] = modes
+
+                self._delta(channel, state, 'mode', modes='+' + ''.join(sorted(modes)))
+
+    def run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+
+            try:
+                with self.lock:
+                    for channel, state in self.channels.items():
+                        self._full(channel, state)
+
+            except Exception as e:
+                print(f'channel_state::run: exception {e}')
@@ -0,0 +1,133 @@
+#! /usr/bin/python3
+
+import collections
+import threading
+import time
+
+
+# stops sending commands to a plugin that does not reply (in time)
+#
+# per command the outcome of the last `window` requests is kept; a request
+# failed when it timed out or took longer than slow_threshold seconds.
+# - closed: everything goes through; when at least min_samples are known and
+#   failure_ratio of them failed, the breaker opens
+# - open: requests are refused right away for cool_down seconds
+# - half-open: one request is let through as a probe; when it succeeds the
+#   breaker closes, else it opens again (for twice as long, up to
+#   max_cool_down). the probe is the request with the correlation id given
+#   to probe_started(); results of other (older) requests are ignored
+# it is fed by pending_requests and thus only sees commands of plugins that
+# use correlation ids: for the other ones a missing reply cannot be told
+# apart from a command that needs no reply.
+class circuit_breaker:
+    def __init__(self, window, min_samples, failure_ratio, slow_threshold, cool_down, max_cool_down):
+        self.window         = window
+        self.min_samples    = min_samples
+        self.failure_ratio  = failure_ratio
+        self.slow_threshold = slow_threshold
+        self.cool_down      = cool_down
+        self.max_cool_down  = max_cool_down
+
+        self.lock           = threading.Lock()
+
+        self.breakers       = dict()  # command -> dict
+
+    # invoked with lock held
+    def _get(self, command):
+        b = self.breakers.get(command)
+
+        if b == None:
+            b = { 'state': 'closed', 'outcomes': collections.deque(maxlen=self.window), 'opened_at': 0., 'cool_down': self.cool_down, 'probe': None, 'opened': 0, 'refused': 0 }
+
+            self.breakers[command] = b
+
+        return b
+
+    # invoked with lock held
+    def _open(self, b, now, cool_down):
+        b['state']     = 'open'
+        b['opened_at'] = now
+        b['cool_down'] = cool_down
+        b['probe']     = None
+        b['opened']   += 1
+
+    # returns None when the command may be sent, else the number of seconds
+    # until the next attempt. when half-open, the request becomes the probe
+    # once probe_started() is invoked with its correlation id
+    def check(self, command):
+        now = time.time()
+
+        with self.lock:
+            b = self.breakers.get(command)
+
+            if b == None or b['state'] == 'closed':
+                return None
+
+            if b['state'] == 'open' and now - b['opened_at'] >= b['cool_down']:
+                b['state'] = 'half-open'
+
+            if b['state'] == 'half-open' and b['probe'] == None:
+                return None
+
+            b['refused'] += 1
+
+            return max(0., b['opened_at'] + b['cool_down'] - now)
+
+    # a request that check() let through was sent with correlation id corr
+    # (None: without one)
+    def probe_started(self, command, corr):
+        if corr == None:
+            return
+
+        with self.lock:
+            b = self.breakers.get(command)
+
+            if b != None and b['state'] == 'half-open' and b['probe'] == None:
+                b['probe'] = corr
+
+    # listener for pending_requests; outcome is 'ok' or 'timeout'
+    def on_result(self, command, outcome, took, corr):
+        failed = outcome == 'timeout' or took > self.slow_threshold
+
+        now    = time.time()
+
+        with self.lock:
+            b = self._get(command)
+
+            if b['state'] == 'half-open':
+                if b['probe'] != corr:  # a request from before the breaker opened
+                    return
+
+                if failed:
+                    self._open(b, now, min(b['cool_down'] * 2, self.max_cool_down))
+
+                else:
+                    b['state'] = 'closed'
+                    b['probe'] = None
+
+                    b['outcomes'].clear()
+
+                return
+
+            b['outcomes'].append(failed)
+
+            if b['state'] == 'closed' and len(b['outcomes']) >= self.min_samples and sum(b['outcomes']) / len(b['outcomes']) >= self.failure_ratio:
+                print(f'circuit_breaker: opening breaker for {command}')
+
+                self._open(b, now, self.cool_down)
+
+                b['outcomes'].clear()
+
+    # e.g. when the plugin is gone or no longer uses correlation ids
+    def forget(self, command):
+        with self.lock:
+            self.breakers.pop(command, None)
+
+    def get_stats(self):
+        with self.lock:
+            out = dict()
+
+            for command, b in self.breakers.items():
+                out[command] = { 'state': b['state'], 'samples': len(b['outcomes']), 'failures': sum(b['outcomes']), 'opened': b['opened'], 'refused': b['refused'] }
+
+            return out
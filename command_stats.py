@@ -0,0 +1,118 @@
+#! /usr/bin/python3
+
+import threading
+import time
+
+
+# counts command invocations in memory and periodically writes them to the
+# command_stats table in one batch; nothing touches the database while a
+# command is being processed
+class command_stats(threading.Thread):
+    outcomes = ('granted', 'denied', 'unknown')
+
+    def __init__(self, db, flush_interval):
+        super().__init__()
+
+        self.db             = db  # a dbi instance that is not used by the command processing
+
+        self.flush_interval = flush_interval
+
+        self.counts         = dict()  # (command, channel, account, outcome) -> [count, last_seen]
+        self.lock           = threading.Lock()
+
+        self.name = 'GHBot stats'
+        self.start()
+
+    # unknown commands are whatever people type: they share one bucket so
+    # that typos and spam cannot grow the table without bound
+    def count(self, command, channel, account, outcome):
+        if outcome == 'unknown':
+            command = '(unknown)'
+
+        key = (command.lower()[0:64], channel.lower()[0:64], account.lower()[0:256], outcome)
+
+        now = time.time()
+
+        with self.lock:
+            entry = self.counts.get(key)
+
+            if entry == None:
+                self.counts[key] = [1, now]
+
+            else:
+                entry[0] += 1
+                entry[1]  = now
+
+    def flush(self):
+        with self.lock:
+            counts      = self.counts
+            self.counts = dict()
+
+        if len(counts) == 0:
+            return
+
+        rows = [(key[0], key[1], key[2], key[3], entry[0], time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry[1]))) for key, entry in counts.items()]
+
+        try:
+            with self.db.lock:
+                self.db.probe()
+
+                with self.db.db.cursor() as cursor:
+                    cursor.executemany('INSERT INTO command_stats(command, channel, account, outcome, count, last_seen) VALUES(%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE count=count+VALUES(count), last_seen=VALUES(last_seen)', rows)
+
+                    self.db.db.commit()
+
+        except Exception as e:
+            print(f'command_stats::flush: failed to store {len(rows)} rows, retrying later: {e}')
+
+            # put them back so that they're not lost
+            with self.lock:
+                for key, entry in counts.items():
+                    current = self.counts.get(key)
+
+                    if current == None:
+                        self.counts[key] = entry
+
+                    else:
+                        current[0] += entry[0]
+                        current[1]  = max(current[1], entry[1])
+
+    # returns [(command, channel, account, outcome, count), ...], including
+    # the counts that were not flushed yet
+    def get_rows(self, command=None):
+        totals = dict()
+
+        with self.db.lock:
+            self.db.probe()
+
+            with self.db.db.cursor() as cursor:
+                if command == None:
+                    cursor.execute('SELECT command, channel, account, outcome, count FROM command_stats')
+
+                else:
+                    cursor.execute('SELECT command, channel, account, outcome, count FROM command_stats WHERE command=%s', (command.lower(),))
+
+                for row in cursor.fetchall():
+                    totals[tuple(row[0:4])] = row[4]
+
+        with self.lock:
+            for key, entry in self.counts.items():
+                if command == None or key[0] == command.lower():
+                    totals[key] = totals.get(key, 0) + entry[0]
+
+        return [key + (count,) for key, count in totals.items()]
+
+    # returns [(item, count), ...] with the highest count first
+    def top(self, rows, column, n):
+        totals = dict()
+
+        for row in rows:
+            totals[row[column]] = totals.get(row[column], 0) + row[4]
+
+        return sorted(totals.items(), key=lambda x: x[1], reverse=True)[0:n]
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+
+            self.flush()
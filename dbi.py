@@ -14,6 +14,9 @@ class dbi(threading.Thread):
         self.password = password
         self.database = database
 
+        # for users that share this connection between threads
+        self.lock = threading.Lock()
+
         while True:
             try:
                 self.reconnect()
@@ -62,6 +65,7 @@ class dbi(threading.Thread):
 
     def run(self):
         while True:
-            self.probe()
+            with self.lock:
+                self.probe()
 
             time.sleep(29)
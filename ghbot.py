@@ -1,22 +1,38 @@
 #! /usr/bin/python3
 
+import acl_bulk
+from audit_log import audit_log
+from channel_state import channel_state
+from circuit_breaker import circuit_breaker
+import collections
+from command_stats import command_stats
 import configparser
 from dbi import dbi
 import difflib
 from enum import Enum
+import heapq
+import hostmask
 from http_server import http_server
 from ircbot import ircbot, irc_keepalive
+import json
 import math
 from mqtt_handler import mqtt_handler
 import nltk
+import os
+from pending_requests import pending_requests
 from plugin_handler import plugins_class
+from plugin_registry import plugin_record, plugin_registry
 import random
+from response_cache import response_cache
+from route_table import route_table
 import select
 import socket
 import sys
 import threading
 import time
 import traceback
+from trigger_engine import trigger_engine
+from urllib.parse import unquote
 
 
 class ghbot(ircbot):
@@ -25,60 +41,146 @@ class ghbot(ircbot):
         ERROR        = 0x10
         NOT_INTERNAL = 0xff
 
-    def __init__(self, host, port, nick, password, channels, m, db, cmd_prefix, local_plugin_subdir):
+    plugin_timeout   = 10.   # forget a plugin-command when it did not register for this long
+    plugins_gone_max = 256   # how many forgotten plugin-commands to remember
+    provisional_ttl  = 60.   # how long commands from the persisted registry wait for their plugin
+
+    def __init__(self, host, port, nick, password, channels, m, db, cmd_prefix, local_plugin_subdir, stats=None, audit=None, interest_filter=False, registry_file=None, register_jitter=0, channel_state=None, local_plugin_config=dict(), response_cache=None, slow_after=5., reply_timeout=30., breaker=None):
         super().__init__(host, port, nick, password, channels)
 
         self.cmd_prefix    = cmd_prefix
 
+        self.stats         = stats
+
+        self.audit         = audit
+
+        self.response_cache = response_cache
+
+        # correlation of commands and replies, latency of plugins
+        self.pending        = pending_requests(self, slow_after, reply_timeout)
+
+        # stops publishing commands to plugins that do not reply
+        self.breaker        = breaker
+
+        if self.breaker != None:
+            self.pending.listeners.append(self.breaker.on_result)
+
+        self.channel_state = channel_state
+
+        self.acl_dump_dir  = 'acl-dumps'  # relative path!!
+
         self.db            = db
 
         self.mqtt          = m
 
-        self.plugins       = dict()
-        self.plugins_lock  = threading.Lock()
-        self.plugins_gone  = dict()
+        # wildcard subjects (*!*@host/*) of acls/acl_groups and account_aliasses
+        self.acl_masks     = hostmask.hostmask_matcher()
+        self.alias_masks   = hostmask.hostmask_matcher()
+        self.alias_targets = dict()
+
+        self.load_hostmasks()
+
+        self.registry      = plugin_registry()  # see the plugins property
+        self.plugins_lock  = threading.Lock()   # for writers of the registry and related state
+        self.plugins_gone  = collections.OrderedDict()
+
+        # (deadline, cmd) of registered plugin-commands, see _plugin_cleaner
+        self.plugins_cond      = threading.Condition(self.plugins_lock)
+        self.expiry_heap       = []
+        self.expiry_scheduled  = set()
+
+        self.plugin_commands = dict()  # plugin name (v2 registrations) -> set of commands
 
-        self.local_plugins = plugins_class(self, local_plugin_subdir, 'ghb_')
+        # which events (and for what channels) plugins want to receive, per
+        # registered command: cmd -> (set of events, set of channels or None for all)
+        self.interests       = dict()
+        self.wanted_events   = dict()  # event -> set of channels or None for all
+        self.interest_filter = interest_filter  # False: publish everything, also when no plugin declared interest
+        self.n_suppressed    = dict()  # event -> count
+        self.n_suppressed_lock = threading.Lock()
+
+        # regular expressions (per registered command) for channel messages
+        self.triggers        = trigger_engine()
+
+        self.local_plugins = plugins_class(self, local_plugin_subdir, 'ghb_', **local_plugin_config)
 
         now                = time.time()
 
+        plugins            = dict()
+
         #                          v make these into dictionaries v  TODO
-        self.plugins['addacl']   = ['Add an ACL, format: addacl user|group <user|group> group|cmd <group-name|cmd-name>', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['delacl']   = ['Remove an ACL, format: delacl <user> group|cmd <group-name|cmd-name>', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['listacls'] = ['List all ACLs for a user or group', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['deluser']  = ['Forget a person; removes all ACLs for that nick', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['clone']    = ['Clone ACLs from one user to another', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['meet']     = ['Use this when a user (nick) has a new hostname: meet <nick>', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['merge']    = ['Use this to add a host-alias for an existing user (nick): merge <new-nick> <old-nick>', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['commands'] = ['Show list of known commands', None, now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['help']     = ['Help for commands, parameter is the command to get help for', None, now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['more']     = ['Continue outputting a too long line of text', None, now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['define']   = ['Define a command that will be replied to with a definable text, format: !define <command> <text... with %m (/me), %q (parameters) and %u (nick of invoker) escapes, %n for notice>', None, now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['deldefine']= ['Delete a define (by number)', None, now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['alias']    = ['Add a different name for a command, format: !alias <newname> <oldname>', None, now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['searchdefine'] = ['Search for defines that match a partial text', None, now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['searchalias'] = ['Search for aliases that match a partial text', None, now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['viewalias'] = ['Show what an alias is doing', None, now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['listgroups']= ['Shows a list of available groups', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['showgroup']= ['Shows a list of commands or members in a group (showgroup commands|members <groupname>)', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['apro']     = ['Show commands that match a partial text', None, now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['reloadlp'] = ['Reload a "local" plugin', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['listlp']   = ['List "local" plugins', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['showlp']   = ['Show commands of a "local" plugin', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
-        self.plugins['loadlp']   = ['Load "local" plugins that are not loaded yet', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['addacl']   = ['Add an ACL, format: addacl user|group <user|group> group|cmd <group-name|cmd-name>', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['delacl']   = ['Remove an ACL, format: delacl <user> group|cmd <group-name|cmd-name>', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['listacls'] = ['List all ACLs for a user or group', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['deluser']  = ['Forget a person; removes all ACLs for that nick', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['clone']    = ['Clone ACLs from one user to another', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['meet']     = ['Use this when a user (nick) has a new hostname: meet <nick>', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['merge']    = ['Use this to add a host-alias for an existing user (nick): merge <new-nick> <old-nick>', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['commands'] = ['Show list of known commands', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['help']     = ['Help for commands, parameter is the command to get help for', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['more']     = ['Continue outputting a too long line of text', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['define']   = ['Define a command that will be replied to with a definable text, format: !define <command> <text... with %m (/me), %q (parameters) and %u (nick of invoker) escapes, %n for notice>', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['deldefine']= ['Delete a define (by number)', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['alias']    = ['Add a different name for a command, format: !alias <newname> <oldname>', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['searchdefine'] = ['Search for defines that match a partial text', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['searchalias'] = ['Search for aliases that match a partial text', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['viewalias'] = ['Show what an alias is doing', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['listgroups']= ['Shows a list of available groups', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['showgroup']= ['Shows a list of commands or members in a group (showgroup commands|members <groupname>)', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['apro']     = ['Show commands that match a partial text', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['reloadlp'] = ['Reload a "local" plugin', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['listlp']   = ['List "local" plugins', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['showlp']   = ['Show commands of a "local" plugin', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['loadlp']   = ['Load "local" plugins that are not loaded yet', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['importacls'] = ['Bulk import ACLs from a .json or .csv file in the acl-dump directory: importacls <file>', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['stats']    = ['Show command usage statistics: stats [command]', None, now, 'Flok', 'harkbot.vm.nurd.space']
+        plugins['exportacls'] = ['Bulk export all ACLs to a .json or .csv file in the acl-dump directory: exportacls <file>', 'sysops', now, 'Flok', 'harkbot.vm.nurd.space']
+
+        # who is changing ACLs in the current thread, for the audit log
+        self.audit_actor = threading.local()
 
         self.hardcoded_plugins = set()
-        for p in self.plugins:
+        for p in plugins:
             self.hardcoded_plugins.add(p)
 
+        self.local_commands = set()  # commands of the local plugins
+
         for local_plugin in self.local_plugins.list_plugins():  # iterate over each plugin .py-file
             all_commands = self.local_plugins.get_commandos(local_plugin)
 
             for command, parameters in all_commands:  # iterate over each command that a plugin can have
                 # they're hardcoded; don't allow to override
                 self.hardcoded_plugins.add(command)
+                self.local_commands.add(command)
                 # register in the plugin-list
-                self.plugins[command] = parameters
+                plugins[command] = parameters
+
+        for command in plugins:
+            self.registry.touch(command, now)
+
+        self.registry.update({ command: plugin_record.from_list(parameters) for command, parameters in plugins.items() })
+
+        # commands from the previous run are available right away; they're
+        # forgotten when their plugin does not confirm them in time
+        self.registry_file  = registry_file
+        self.registry_saved = None
+
+        if self.registry_file != None and os.path.exists(self.registry_file):
+            try:
+                persisted = { cmd: record for cmd, record in plugin_registry.load(self.registry_file).items() if not cmd in self.hardcoded_plugins }
+
+                with self.plugins_cond:
+                    for command in persisted:
+                        self.registry.touch(command, now + ghbot.provisional_ttl - ghbot.plugin_timeout)
+
+                        self._schedule_expiry(command)
+
+                self.registry_saved = self.registry.update(persisted).version
+
+                print(f'ghbot: {len(persisted)} provisional commands loaded from {self.registry_file}')
+
+            except Exception as e:
+                print(f'ghbot: cannot load registry from {self.registry_file}: {e}')
 
         self.topic_privmsg = []
         self.topic_notice  = []
@@ -95,6 +197,13 @@ class ghbot(ircbot):
 
         self.topic_request = f'to/bot/request'  # topic where plugins request bot-actions
 
+        self.pm_topic = 'to/irc/\\'  # to match on
+
+        self.route_stats      = dict()  # route name -> [count, total time, max time]
+        self.route_stats_lock = threading.Lock()
+
+        self._build_routes()
+
         self.mqtt.subscribe(self.topic_request, self._recv_msg_cb)
 
         for topic in self.topic_privmsg:
@@ -107,7 +216,6 @@ class ghbot(ircbot):
             self.mqtt.subscribe(topic, self._recv_msg_cb)
 
         self.mqtt.subscribe('to/irc/#', self._recv_msg_cb)  # required for pm-commands :-/
-        self.pm_topic = 'to/irc/\\'  # to match on
 
         self.mqtt.subscribe(self.topic_to_nick + '#', self._recv_msg_cb)
 
@@ -131,39 +239,143 @@ class ghbot(ircbot):
         self.plugin_cleaner = threading.Thread(target=self._plugin_cleaner)
         self.plugin_cleaner.start()
 
+        if self.registry_file != None:
+            self.registry_saver = threading.Thread(target=self._registry_saver)
+            self.registry_saver.name = 'GHBot registry saver'
+            self.registry_saver.start()
+
+        # plugins should spread their answer to 'register' over this many seconds
+        self._plugin_parameter('register-jitter', str(register_jitter), True)
+
         # ask plugins to register themselves so that we know which
         # commands are available (and what they're for etc.)
         self._plugin_command('register')
 
         self._plugin_parameter('prefix', self.cmd_prefix, True)
 
-    # checks how old the the latest registration of a plugin is.
-    # too old? (10 seconds) then forget the plugin-command.
+        self.local_plugins.start_watcher()
+
+    # current snapshot of the plugin registry: cmd -> plugin_record
+    @property
+    def plugins(self):
+        return self.registry.snapshot.plugins
+
+    # local plugins were (re)loaded or removed; bring the registry in line
+    def local_plugins_changed(self):
+        now     = time.time()
+
+        records = dict()
+
+        for local_plugin in self.local_plugins.list_plugins():
+            for command, parameters in self.local_plugins.get_commandos(local_plugin):
+                records[command] = plugin_record.from_list(parameters)
+
+        with self.plugins_lock:
+            gone = [command for command in self.local_commands if not command in records]
+
+            for command in gone:
+                self.hardcoded_plugins.discard(command)
+
+            for command in records:
+                self.hardcoded_plugins.add(command)
+
+                self.registry.touch(command, now)
+
+            self.local_commands = set(records)
+
+            self.registry.update(records, gone)
+
+    # forgets plugin-commands that did not register for plugin_timeout
+    # seconds. every command has one entry in a heap ordered by deadline; when
+    # it comes up the actual deadline is checked (the plugin may have
+    # re-registered in the mean time) and it is either expired or pushed back.
     def _plugin_cleaner(self):
         while True:
             try:
-                time.sleep(4.9)
+                with self.plugins_cond:
+                    now       = time.time()
+
+                    to_delete = []
 
-                to_delete = []
+                    while len(self.expiry_heap) > 0 and self.expiry_heap[0][0] <= now:
+                        deadline, plugin = heapq.heappop(self.expiry_heap)
 
-                now       = time.time()
+                        if not plugin in self.plugins or plugin in self.hardcoded_plugins:
+                            self.expiry_scheduled.discard(plugin)
 
-                self.plugins_lock.acquire()
+                            continue
 
-                for plugin in self.plugins:
-                    if now - self.plugins[plugin][2] >= 10. and plugin not in self.hardcoded_plugins:  # 5 seconds timeout
-                        to_delete.append(plugin)
+                        deadline = self.registry.latest_ka(plugin) + ghbot.plugin_timeout
 
-                for plugin in to_delete:
-                    del self.plugins[plugin]
+                        if deadline > now:
+                            heapq.heappush(self.expiry_heap, (deadline, plugin))
 
-                    self.plugins_gone[plugin] = now
+                        else:
+                            self.expiry_scheduled.discard(plugin)
 
-                self.plugins_lock.release()
+                            to_delete.append(plugin)
+
+                    self.registry.update(remove=to_delete)
+
+                    for plugin in to_delete:
+                        self.plugins_gone[plugin] = now
+                        self.plugins_gone.move_to_end(plugin)
+
+                        self.interests.pop(plugin, None)
+
+                        self.triggers.remove(plugin)
+
+                        if self.response_cache != None:
+                            self.response_cache.set_ttl(plugin, 0)
+
+                        self.pending.set_options(plugin, False)
+
+                        if self.breaker != None:
+                            self.breaker.forget(plugin)
+
+                    while len(self.plugins_gone) > ghbot.plugins_gone_max:
+                        self.plugins_gone.popitem(last=False)
+
+                    if len(to_delete) > 0:
+                        self._compile_interests()
+
+                        for name in list(self.plugin_commands):
+                            self.plugin_commands[name].difference_update(to_delete)
+
+                            if len(self.plugin_commands[name]) == 0:
+                                del self.plugin_commands[name]
+
+                    timeout = self.expiry_heap[0][0] - now if len(self.expiry_heap) > 0 else None
+
+                    self.plugins_cond.wait(timeout)
 
             except Exception as e:
                 print(f'_plugin_cleaner: failed to clean: {e}')
 
+                time.sleep(1)
+
+    def _registry_saver(self):
+        while True:
+            time.sleep(30)
+
+            try:
+                if self.registry.current().version != self.registry_saved:
+                    self.registry_saved = self.registry.save(self.registry_file, self.hardcoded_plugins)
+
+            except Exception as e:
+                print(f'_registry_saver: cannot store registry in {self.registry_file}: {e}')
+
+    # invoked with plugins_lock held
+    def _schedule_expiry(self, cmd):
+        if cmd in self.expiry_scheduled:
+            return
+
+        self.expiry_scheduled.add(cmd)
+
+        heapq.heappush(self.expiry_heap, (self.registry.latest_ka(cmd) + ghbot.plugin_timeout, cmd))
+
+        self.plugins_cond.notify()
+
     def _plugin_command(self, cmd):
         self.mqtt.publish('from/bot/command', cmd, persistent=False)
 
@@ -174,111 +386,421 @@ class ghbot(ircbot):
         self.plugins_lock.acquire()
 
         try:
-            elements = msg.split('|')
+            if msg[0:1] == '{':
+                self._register_plugin_v2(json.loads(msg))
+
+            else:
+                self._register_plugin_v1(msg)
+
+        except Exception as e:
+            print(f'_register_plugin: problem while processing plugin registration "{msg}": {e}')
+
+        self.plugins_lock.release()
+
+    # cmd=...|descr=...|agrp=...|athr=...|loc=...|evts=...|chans=...|trig=...|cache=...|corr=...|deadline=...
+    # one message per command; invoked with plugins_lock held
+    def _register_plugin_v1(self, msg):
+        elements = msg.split('|')
+
+        cmd       = None
+        descr     = ''
+        acl_group = None
+        athr      = ''
+        location  = ''
+        events    = None
+        channels  = None
+        triggers  = []
+        cache_ttl = 0
+        corr      = False
+        deadline  = None
+
+        for element in elements:
+            k, v = element.split('=', 1)
+
+            if k == 'cmd':
+                cmd = v
+
+            elif k == 'descr':
+                descr = v
+
+            elif k == 'agrp':
+                acl_group = v
+
+            elif k == 'athr':
+                athr = v
+
+            elif k == 'loc':
+                location = v
+
+            elif k == 'evts':  # e.g. evts=message,join,part
+                events = set([e.strip().lower() for e in v.split(',') if e.strip() != ''])
+
+            elif k == 'chans':  # e.g. chans=nurds,#test
+                channels = set([c.strip().lstrip('#').lower() for c in v.split(',') if c.strip() != ''])
+
+            elif k == 'trig':  # url-encoded regular expression, can be repeated
+                triggers.append(unquote(v))
+
+            elif k == 'cache':  # seconds that replies can be re-used
+                cache_ttl = float(v)
+
+            elif k == 'corr':  # corr=1: commands come with a correlation id that is echoed in the reply topic
+                corr = v == '1'
+
+            elif k == 'deadline':  # seconds before the user is told that there was no reply
+                deadline = float(v)
+
+        if cmd != None:
+            self._register_command(cmd, descr, acl_group, athr, location, events, channels, triggers, cache_ttl, corr, deadline)
+
+        else:
+            print(f'_register_plugin: cmd missing in plugin registration')
+
+    # JSON, all commands of a plugin in one message:
+    # { "v": 2, "plugin": "name", "athr": ..., "loc": ..., "evts": [...], "chans": [...],
+    #   "commands": [ { "cmd": ..., "descr": ..., "agrp": ..., "trig": [...], "cache": seconds,
+    #                   "correlation": true, "deadline": seconds }, ... ] }
+    # or a heartbeat that refreshes all commands of an earlier registration:
+    # { "v": 2, "heartbeat": "name" }
+    # invoked with plugins_lock held
+    def _register_plugin_v2(self, msg):
+        if 'heartbeat' in msg:
+            name = msg['heartbeat']
 
-            cmd       = None
-            descr     = ''
-            acl_group = None
-            athr      = ''
-            location  = ''
+            if not name in self.plugin_commands:
+                # e.g. when the bot restarted; only ask this plugin
+                self.mqtt.publish(f'from/bot/plugin/{name}/command', 'register')
 
-            for element in elements:
-                k, v = element.split('=')
+                return
+
+            now = time.time()
+
+            plugins = self.plugins
+
+            for cmd in self.plugin_commands[name]:
+                if cmd in plugins:
+                    self.registry.touch(cmd, now)
+
+            return
+
+        name     = msg['plugin']
+
+        events   = set([e.lower() for e in msg['evts']]) if 'evts' in msg else None
+        channels = set([c.lstrip('#').lower() for c in msg['chans']]) if 'chans' in msg else None
 
-                if k == 'cmd':
-                    cmd = v
-                
-                elif k == 'descr':
-                    descr = v
+        commands = set()
+
+        for command in msg['commands']:
+            cmd = command['cmd']
+
+            if self._register_command(cmd, command.get('descr', ''), command.get('agrp'), msg.get('athr', ''), msg.get('loc', ''), events, channels, command.get('trig', []), float(command.get('cache', 0)), command.get('correlation', False), float(command['deadline']) if 'deadline' in command else None):
+                commands.add(cmd)
+
+        self.plugin_commands[name] = commands
+
+    # returns False if the command cannot be registered; invoked with plugins_lock held
+    def _register_command(self, cmd, descr, acl_group, athr, location, events, channels, triggers, cache_ttl, corr, deadline):
+        if cmd in self.hardcoded_plugins:
+            print(f'_register_plugin: cannot override "hardcoded" plugin ({cmd})')
+
+            return False
+
+        if not cmd in self.plugins:
+            print(f'_register_plugin: first announcement of {cmd}')
+
+        self.registry.touch(cmd, time.time())
+
+        self.registry.update({ cmd: plugin_record(descr, acl_group, athr, location) })
+
+        if cmd in self.plugins_gone:
+            del self.plugins_gone[cmd]
+
+        self._schedule_expiry(cmd)
+
+        self._set_interest(cmd, events, channels)
+
+        self.triggers.set_triggers(cmd, triggers)
+
+        if self.response_cache != None:
+            self.response_cache.set_ttl(cmd, cache_ttl)
+
+        self.pending.set_options(cmd, corr, deadline)
+
+        # the breaker is fed by correlated replies only: without them it would
+        # never close again
+        if self.breaker != None and not corr:
+            self.breaker.forget(cmd)
+
+        return True
 
-                elif k == 'agrp':
-                    acl_group = v
+    # invoked with plugins_lock held
+    def _set_interest(self, cmd, events, channels):
+        interest = (frozenset(events), frozenset(channels) if channels != None and len(channels) > 0 else None) if events != None else None
 
-                elif k == 'athr':
-                    athr = v
+        if self.interests.get(cmd) == interest:
+            return
 
-                elif k == 'loc':
-                    location = v
+        if interest == None:
+            del self.interests[cmd]
 
-            if cmd != None:
-                if not cmd in self.hardcoded_plugins:
-                    if not cmd in self.plugins:
-                        print(f'_register_plugin: first announcement of {cmd}')
+        else:
+            self.interests[cmd] = interest
 
-                    self.plugins[cmd] = [descr, acl_group, time.time(), athr, location]
+        self._compile_interests()
 
-                    if cmd in self.plugins_gone:
-                        del self.plugins_gone[cmd]
+    # invoked with plugins_lock held
+    def _compile_interests(self):
+        wanted = dict()
+
+        for events, channels in self.interests.values():
+            for event in events:
+                if event in wanted and wanted[event] == None:
+                    continue
+
+                if channels == None:
+                    wanted[event] = None
 
                 else:
-                    print(f'_register_plugin: cannot override "hardcoded" plugin ({cmd})')
+                    wanted[event] = wanted.get(event, set()) | channels
 
-            else:
-                print(f'_register_plugin: cmd missing in plugin registration')
+        self.wanted_events = wanted
 
-        except Exception as e:
-            print(f'_register_plugin: problem while processing plugin registration "{msg}": {e}')
+    # channel is None for events that are not bound to a channel (nick, quit)
+    def wants_event(self, event, channel):
+        wanted = self.wanted_events
 
-        self.plugins_lock.release()
+        if not event in wanted:
+            return False
+
+        channels = wanted[event]
+
+        return channels == None or channel == None or channel.lower() in channels
+
+    # matches are published to from/bot/trigger/<cmd>
+    def check_triggers(self, channel, prefix, text):
+        for cmd, pattern, m in self.triggers.match(text):
+            out = dict()
+            out['channel'] = channel
+            out['prefix']  = prefix
+            out['text']    = text
+            out['pattern'] = pattern
+            out['match']   = m.group(0)
+            out['groups']  = m.groups()
+
+            self.mqtt.publish(f'from/bot/trigger/{cmd}', json.dumps(out))
+
+    def publish_event(self, event, channel, topic, payload):
+        if event == 'message' and self.response_cache != None:
+            # a plugin may respond to it
+            self.response_cache.activity(channel.lower())
+
+        if self.interest_filter and not self.wants_event(event, channel):
+            with self.n_suppressed_lock:
+                self.n_suppressed[event] = self.n_suppressed.get(event, 0) + 1
+
+            return
+
+        self.mqtt.publish(topic, payload)
+
+    # serves cacheable commands from the response cache when possible,
+    # refuses commands of plugins whose circuit breaker is open and adds a
+    # correlation id for plugins that asked for one
+    def publish_command(self, channel, prefix, command, text, topic):
+        if channel != None:
+            channel = channel.lower()
+
+        nick      = prefix.split('!')[0]
+
+        reply_to  = '#' + channel if channel != None else nick
+
+        cache_key = None
+
+        if self.response_cache != None and channel != None and self.response_cache.is_cacheable(command):
+            cache_key = response_cache.make_key(command, text, channel)
+
+            replies   = self.response_cache.lookup(cache_key)
+
+            if replies != None:
+                for kind, reply in replies:
+                    if kind == 'notice':
+                        self.send_notice(reply_to, reply)
+
+                    else:
+                        self.send_ok(reply_to, self.escapes(reply))
+
+                return
+
+        if self.breaker != None:
+            retry_in = self.breaker.check(command)
+
+            if retry_in != None:
+                method = self.send_error_notice if channel != None else self.send_error
+
+                method(reply_to, f'{nick.lower()}: command "{command}" is temporarily unavailable (too slow or not replying), try again in {retry_in:.0f} seconds')
+
+                return
+
+        corr = self.pending.dispatch(command, channel, reply_to)
+
+        if self.response_cache != None and channel != None:
+            if cache_key != None:
+                self.response_cache.expect(cache_key, channel, corr)
+
+            elif corr == None:  # the replies of a correlated command can be told apart
+                self.response_cache.activity(channel)
+
+        if self.breaker != None:
+            self.breaker.probe_started(command, corr)
+
+        if corr != None:
+            text = json.dumps({ 'corr': corr, 'text': text })
+
+        self.mqtt.publish(topic, text)
 
     def _send_topics_to_plugins(self):
         for channel in self.topics:
             self.mqtt.publish(f'from/irc/{channel}/topic', self.topics[channel])
 
+    # maps topics (without prefix) to (route name, handler); must be invoked
+    # again when self.channels changes
+    def _build_routes(self):
+        routes = route_table()
+
+        # replies can carry the correlation id of a command as an extra level:
+        # to/irc/<channel>/privmsg/<id>
+        for channel in self.channels:
+            routes.add(f'to/irc/{channel[1:]}/privmsg', 'privmsg', self._route_privmsg, correlated=True)
+            routes.add(f'to/irc/{channel[1:]}/notice',  'notice',  self._route_notice,  correlated=True)
+            routes.add(f'to/irc/{channel[1:]}/topic',   'topic',   self._route_topic)
+            routes.add(f'to/irc/{channel[1:]}/mode',    'mode',    self._route_mode)
+
+        routes.add(self.topic_request,  'request',  self._route_request)
+        routes.add(self.topic_register, 'register', self._route_register)
+
+        # topics with a variable part (a nick) are matched on their first two
+        # levels; to/irc/\<nick>/<id> for a reply with a correlation id
+        routes.add_shape(self.topic_to_nick.split('/')[0:2], 'to-nick', self._route_to_nick)
+        routes.add_shape(self.pm_topic.split('/')[0:2],      'pm',      self._route_pm, corr_level=3)
+
+        self.routes = routes
+
+    def _route_privmsg(self, parts, msg, corr):
+        if self.response_cache != None:
+            self.response_cache.reply(parts[2].lower(), 'privmsg', msg, corr)
+
+        self.pending.reply(parts[2].lower(), corr)
+
+        self.send_ok('#' + parts[2], self.escapes(msg))
+
+    def _route_notice(self, parts, msg, corr):
+        if self.response_cache != None:
+            self.response_cache.reply(parts[2].lower(), 'notice', msg, corr)
+
+        self.pending.reply(parts[2].lower(), corr)
+
+        self.send_notice('#' + parts[2], msg)
+
+    def _route_topic(self, parts, msg, corr):
+        self.send(f'TOPIC #{parts[2]} :{msg}')
+
+    def _route_mode(self, parts, msg, corr):
+        self.send(f'MODE #{parts[2]} {msg}')
+
+    def _route_request(self, parts, msg, corr):
+        print(f'plugin requested {msg}')
+
+        if msg == 'topics':
+            self._send_topics_to_plugins()
+
+    def _route_register(self, parts, msg, corr):
+        self._register_plugin(msg)
+
+    def _route_to_nick(self, parts, msg, corr):
+        nick = parts[2]
+
+        if nick[0] == '\\':
+            nick = nick[1:]
+
+        self.send_ok(nick, msg)
+
+    def _route_pm(self, parts, msg, corr):
+        if len(parts) < 3 or parts[2][0:1] != '\\':
+            return False
+
+        nick = parts[2][1:]  # remove '\'
+
+        if corr != None:
+            self.pending.reply(None, corr)
+
+        self.send_ok(nick, msg)
+
+    def get_route_stats(self):
+        with self.route_stats_lock:
+            return { name: { 'count': stats[0], 'avg_ms': stats[1] * 1000. / stats[0], 'max_ms': stats[2] * 1000. } for name, stats in self.route_stats.items() }
+
     def _recv_msg_cb(self, topic, msg):
         try:
             # print(f'irc::_recv_msg_cb: received "{msg}" for topic {topic}')
 
             topic = topic[len(self.mqtt.get_topix_prefix()):]
 
-            parts = topic.split('/')
-
             if msg.find('\n') != -1 or msg.find('\r') != -1:
                 print(f'irc::_recv_msg_cb: invalid content to send for {topic}')
 
                 return
 
-            if topic in self.topic_privmsg:
-                self.send_ok('#' + parts[2], self.escapes(msg))
+            parts = topic.split('/')
+
+            route, corr = self.routes.resolve(parts)
+
+            if route == None:
+                print(f'irc::_recv_msg_cb: invalid topic {topic}')
+
+                return
+
+            start = time.time()
 
-            elif topic in self.topic_notice:
-                self.send_notice('#' + parts[2], msg)
+            if route[1](parts, msg, corr) == False:
+                print(f'irc::_recv_msg_cb: invalid topic {topic}')
 
-            elif topic in self.topic_topic:
-                self.send(f'TOPIC #{parts[2]} :{msg}')
+                return
 
-            elif topic in self.topic_request:
-                print(f'plugin requested {msg}')
-                if msg == 'topics':
-                    self._send_topics_to_plugins()
+            took = time.time() - start
 
-            elif topic in self.topic_register:
-                self._register_plugin(msg)
+            with self.route_stats_lock:
+                stats = self.route_stats.get(route[0])
 
-            elif parts[0] + '/' + parts[1] in self.topic_to_nick:
-                if parts[-1].lower() == 'mode':
-                    self.send(f'MODE #{parts[2]} {msg}')
+                if stats == None:
+                    self.route_stats[route[0]] = [1, took, took]
 
                 else:
-                    nick = parts[2]
+                    stats[0] += 1
+                    stats[1] += took
+                    stats[2]  = max(stats[2], took)
 
-                    if nick[0] == '\\':
-                        nick = nick[1:]
+        except Exception as e:
+            print(f'irc::_recv_msg_cb: exception {e} while processing {topic}|{msg} (at line number: {e.__traceback__.tb_lineno})')
 
-                    self.send_ok(nick, msg)
+    # (re-)compile all wildcard subjects; invoked after every ACL mutation
+    def load_hostmasks(self):
+        try:
+            self.db.probe()
 
-            elif self.pm_topic in topic:
-                nick = parts[2][1:]  # remove '\'
+            with self.db.db.cursor() as cursor:
+                cursor.execute("SELECT who FROM acls WHERE who LIKE '%*%' OR who LIKE '%?%' UNION SELECT who FROM acl_groups WHERE who LIKE '%*%' OR who LIKE '%?%'")
 
-                self.send_ok(nick, msg)
+                self.acl_masks.compile([row[0] for row in cursor.fetchall()])
 
-            else:
-                print(f'irc::_recv_msg_cb: invalid topic {topic}')
+                cursor.execute("SELECT account, main_account FROM account_aliasses WHERE account LIKE '%*%' OR account LIKE '%?%'")
 
-                return
+                alias_targets = { row[0].lower(): row[1].lower() for row in cursor.fetchall() }
+
+                self.alias_masks.compile(alias_targets.keys())
+
+                self.alias_targets = alias_targets
 
         except Exception as e:
-            print(f'irc::_recv_msg_cb: exception {e} while processing {topic}|{msg} (at line number: {e.__traceback__.tb_lineno})')
+            print(f'irc::load_hostmasks: failed to load wildcard subjects: {e}')
 
     def check_acl_alias(self, who):
         with self.db.db.cursor() as cursor:
@@ -292,28 +814,50 @@ class ghbot(ircbot):
 
                 print(f'Using ACL {who}')
 
+            elif not hostmask.is_pattern(who):
+                mask = self.alias_masks.best_match(who)
+
+                if mask != None and mask in self.alias_targets:
+                    who = self.alias_targets[mask]
+
+                    print(f'Using ACL {who} (via {mask})')
+
             return who
 
+    # the subject itself and all wildcard subjects that match it
+    def acl_subjects(self, who):
+        who = who.lower()
+
+        return [who] + [mask for mask in self.acl_masks.match(who) if mask != who]
+
     def check_acls(self, who, command):
-        self.plugins_lock.acquire()
+        access_granted, group_for_command = self._check_acls(who, command)
 
-        # "no group" is for everyone
-        if command in self.plugins and self.plugins[command][1] == None:
-            self.plugins_lock.release()
+        if self.audit != None:
+            self.audit.record('acl', who, command, group_for_command, 'granted' if access_granted else 'denied')
 
-            return (True, None)
+        return (access_granted, group_for_command)
 
-        plugin_group = self.plugins[command][1]
+    def _check_acls(self, who, command):
+        plugins = self.plugins
 
-        self.plugins_lock.release()
+        # "no group" is for everyone
+        if command in plugins and plugins[command].acl_group == None:
+            return (True, None)
+
+        plugin_group = plugins[command].acl_group
 
         self.db.probe()  # to prevent those pesky "sever has gone away" problems
 
         with self.db.db.cursor() as cursor:
             who = self.check_acl_alias(who)
 
+            subjects     = self.acl_subjects(who)
+
+            placeholders = ', '.join(['%s'] * len(subjects))
+
             # check per user ACLs (can override group as defined in plugin)
-            cursor.execute('SELECT COUNT(*) FROM acls WHERE command=%s AND who=%s', (command.lower(), who.lower()))
+            cursor.execute(f'SELECT COUNT(*) FROM acls WHERE command=%s AND who IN ({placeholders})', [command.lower()] + subjects)
 
             row = cursor.fetchone()
 
@@ -321,7 +865,7 @@ class ghbot(ircbot):
                 return (True, plugin_group)
 
             # check per group ACLs (can override group as defined in plugin)
-            cursor.execute('SELECT COUNT(*) FROM acls, acl_groups WHERE acl_groups.who=%s AND acl_groups.group_name=acls.who AND command=%s', (who.lower(), command.lower()))
+            cursor.execute(f'SELECT COUNT(*) FROM acls, acl_groups WHERE acl_groups.who IN ({placeholders}) AND acl_groups.group_name=acls.who AND command=%s', subjects + [command.lower()])
 
             row = cursor.fetchone()
 
@@ -329,7 +873,7 @@ class ghbot(ircbot):
                 return (True, plugin_group)
 
             # check if user is in group as specified by plugin
-            cursor.execute('SELECT COUNT(*) FROM acl_groups WHERE group_name=%s AND who=%s', (plugin_group, who.lower()))
+            cursor.execute(f'SELECT COUNT(*) FROM acl_groups WHERE group_name=%s AND who IN ({placeholders})', [plugin_group] + subjects)
 
             row = cursor.fetchone()
 
@@ -353,7 +897,46 @@ class ghbot(ircbot):
 
             return out
 
+    # ACL mutations are recorded in the audit log with their outcome. the
+    # actor is the IRC user whose command is being processed (see
+    # invoke_internal_commands) unless given explicitly
+    def _audit_change(self, action, target, rc, actor=None):
+        if self.audit != None:
+            if actor == None:
+                actor = getattr(self.audit_actor, 'who', None)
+
+            self.audit.record('admin', actor if actor != None else '(unknown)', action, target, ('ok' if rc[0] else f'failed: {rc[1]}')[0:64])
+
+        return rc
+
     def add_acl(self, who, command):
+        return self._audit_change('add_acl', f'{who} {command}', self._add_acl(who, command))
+
+    def del_acl(self, who, command):
+        return self._audit_change('del_acl', f'{who} {command}', self._del_acl(who, command))
+
+    def forget_acls(self, who):
+        return self._audit_change('forget_acls', who, self._forget_acls(who))
+
+    def import_acls(self, acls, groups, actor=None):
+        return self._audit_change('import_acls', f'{len(acls)} acls, {len(groups)} group memberships', self._import_acls(acls, groups), actor)
+
+    def clone_acls(self, from_, to_):
+        return self._audit_change('clone_acls', f'{from_} {to_}', self._clone_acls(from_, to_))
+
+    def merge_nick(self, new_nick, old_nick):
+        return self._audit_change('merge_nick', f'{new_nick} {old_nick}', self._merge_nick(new_nick, old_nick))
+
+    def update_acls(self, who, new_fullname):
+        return self._audit_change('update_acls', f'{who} {new_fullname}', self._update_acls(who, new_fullname))
+
+    def group_add(self, who, group):
+        return self._audit_change('group_add', f'{who} {group}', self._group_add(who, group))
+
+    def group_del(self, who, group):
+        return self._audit_change('group_del', f'{who} {group}', self._group_del(who, group))
+
+    def _add_acl(self, who, command):
         self.db.probe()
 
         with self.db.db.cursor() as cursor:
@@ -364,12 +947,14 @@ class ghbot(ircbot):
 
                 self.db.db.commit()
 
+                self.load_hostmasks()
+
                 return (True, 'Ok')
 
             except Exception as e:
                 return (False, f'irc::add_acl: failed to insert acl ({e})')
 
-    def del_acl(self, who, command):
+    def _del_acl(self, who, command):
         self.db.probe()
 
         with self.db.db.cursor() as cursor:
@@ -380,6 +965,8 @@ class ghbot(ircbot):
 
                 self.db.db.commit()
 
+                self.load_hostmasks()
+
                 if cursor.rowcount == 1:
                     return (True, 'Ok')
 
@@ -388,7 +975,7 @@ class ghbot(ircbot):
             except Exception as e:
                 return (False, f'irc::del_acl: failed to delete acl ({e})')
 
-    def forget_acls(self, who):
+    def _forget_acls(self, who):
         match_ = who + '!%'
 
         with self.db.db.cursor() as cursor:
@@ -403,6 +990,8 @@ class ghbot(ircbot):
 
                 self.db.db.commit()
 
+                self.load_hostmasks()
+
                 if any_del:
                     return (True, 'Ok')
 
@@ -411,24 +1000,82 @@ class ghbot(ircbot):
             except Exception as e:
                 return (False, f'irc::forget_acls: failed to forget acls for {match_}: {e}')
 
-    def clone_acls(self, from_, to_):
+    # returns ([(who, command), ...], [(group_name, who), ...])
+    def export_acls(self):
+        self.db.probe()
+
         with self.db.db.cursor() as cursor:
-            who = self.check_acl_alias(who)
+            cursor.execute('SELECT who, command FROM acls ORDER BY who, command')
+
+            acls = [(row[0], row[1]) for row in cursor.fetchall()]
+
+            cursor.execute('SELECT group_name, who FROM acl_groups ORDER BY group_name, who')
+
+            groups = [(row[0], row[1]) for row in cursor.fetchall()]
+
+            return (acls, groups)
+
+    # all rows go in one transaction: either everything is imported or nothing
+    # rows that exist already are skipped
+    def _import_acls(self, acls, groups):
+        self.db.probe()
 
+        acls   = [(who.lower(), command.lower()) for who, command in acls]
+        groups = [(group_name.lower(), who.lower()) for group_name, who in groups]
+
+        start = time.time()
+
+        with self.db.db.cursor() as cursor:
             try:
-                cursor.execute('SELECT group_name FROM acl_groups WHERE who=%s', (from_,))
+                n_acls   = 0
+                n_groups = 0
+
+                if len(acls) > 0:
+                    cursor.executemany('INSERT IGNORE INTO acls(who, command) VALUES(%s, %s)', acls)
 
-                for row in cursor.fetchall():
-                    cursor.execute('INSERT INTO acl_groups(group_name, who) VALUES(%s, %s)', (row, to_))
+                    n_acls = cursor.rowcount
+
+                if len(groups) > 0:
+                    cursor.executemany('INSERT IGNORE INTO acl_groups(group_name, who) VALUES(%s, %s)', groups)
+
+                    n_groups = cursor.rowcount
 
                 self.db.db.commit()
 
-                return (True, 'Ok')
+                self.load_hostmasks()
 
             except Exception as e:
-                return (False, f'failed to clone acls: {e}')
+                self.db.db.rollback()
 
-    def merge_nick(self, new_nick, old_nick):
+                return (False, f'irc::import_acls: failed to import acls, nothing imported ({e})')
+
+        n_total = len(acls) + len(groups)
+
+        took    = max(time.time() - start, 0.000001)
+
+        return (True, f'{n_acls} acls and {n_groups} group memberships added, {n_total - n_acls - n_groups} already present ({n_total / took:.0f} rows/s)')
+
+    def _clone_acls(self, from_, to_):
+        self.db.probe()
+
+        from_ = self.check_acl_alias(from_).lower()
+
+        try:
+            with self.db.db.cursor() as cursor:
+                cursor.execute('SELECT group_name FROM acl_groups WHERE who=%s', (from_,))
+
+                groups = [(row[0], to_) for row in cursor.fetchall()]
+
+                cursor.execute('SELECT command FROM acls WHERE who=%s', (from_,))
+
+                acls = [(to_, row[0]) for row in cursor.fetchall()]
+
+        except Exception as e:
+            return (False, f'failed to clone acls: {e}')
+
+        return self._import_acls(acls, groups)
+
+    def _merge_nick(self, new_nick, old_nick):
         with self.db.db.cursor() as cursor:
             if '%' in old_nick or '%' in new_nick:
                 return (False, 'haxxxor')
@@ -454,13 +1101,15 @@ class ghbot(ircbot):
 
                 self.db.db.commit()
 
+                self.load_hostmasks()
+
                 return (True, 'Ok')
 
             except Exception as e:
                 return (False, f'failed to add alias: {e}, {e.__traceback__.tb_lineno}')
 
     # new_fullname is the new 'nick!user@host'
-    def update_acls(self, who, new_fullname):
+    def _update_acls(self, who, new_fullname):
         self.db.probe()
 
         match_ = who + '!%'
@@ -477,6 +1126,8 @@ class ghbot(ircbot):
 
                 self.db.db.commit()
 
+                self.load_hostmasks()
+
                 if any_upd:
                     return (True, 'Ok')
 
@@ -485,7 +1136,7 @@ class ghbot(ircbot):
             except Exception as e:
                 return (False, f'irc::update_acls: failed to update acls ({e})')
 
-    def group_add(self, who, group):
+    def _group_add(self, who, group):
         self.db.probe()
 
         who = self.check_acl_alias(who)
@@ -496,12 +1147,14 @@ class ghbot(ircbot):
 
                 self.db.db.commit()
 
+                self.load_hostmasks()
+
                 return (True, 'Ok')
 
             except Exception as e:
                 return (False, f'irc::group_add: failed to insert group-member ({e})')
 
-    def group_del(self, who, group):
+    def _group_del(self, who, group):
         self.db.probe()
 
         who = self.check_acl_alias(who)
@@ -512,6 +1165,8 @@ class ghbot(ircbot):
 
                 self.db.db.commit()
 
+                self.load_hostmasks()
+
                 if cursor.rowcount == 1:
                     return (True, 'Ok')
 
@@ -582,13 +1237,7 @@ class ghbot(ircbot):
                 self.cond_352.wait(5.0 - t_diff)
 
     def list_plugins(self):
-        self.plugins_lock.acquire()
-
-        plugins = ', '.join(sorted(self.plugins))
-
-        self.plugins_lock.release()
-
-        return plugins
+        return ', '.join(sorted(self.plugins))
 
     def add_define(self, command, is_alias, arguments):
         self.db.probe()
@@ -744,7 +1393,21 @@ class ghbot(ircbot):
 
             return (is_command, text, notice)
 
+    def count_command(self, command, channel, prefix, outcome):
+        if self.stats != None:
+            self.stats.count(command, '(private)' if channel == self.nick else channel, prefix, outcome)
+
     def invoke_internal_commands(self, prefix, command, splitted_args, channel):
+        # ACL changes made by the command are audited on behalf of prefix
+        self.audit_actor.who = prefix
+
+        try:
+            return self._invoke_internal_commands(prefix, command, splitted_args, channel)
+
+        finally:
+            self.audit_actor.who = None
+
+    def _invoke_internal_commands(self, prefix, command, splitted_args, channel):
         identifier  = None
 
         target_type = None
@@ -786,7 +1449,7 @@ class ghbot(ircbot):
 
             cmd_idx   = self.find_key_in_list(splitted_args, 'cmd',   2)
 
-            if not identifier_is_known and target_type == 'user':
+            if not identifier_is_known and target_type == 'user' and not hostmask.is_pattern(check_user):
                 self.invoke_who_and_wait(check_user)
 
                 if check_user in self.users:
@@ -811,12 +1474,8 @@ class ghbot(ircbot):
             elif cmd_idx != None:
                 cmd_name = splitted_args[cmd_idx + 1]
 
-                self.plugins_lock.acquire()
-
                 plugin_known = cmd_name in self.plugins
 
-                self.plugins_lock.release()
-
                 if plugin_known:
                     rc = self.add_acl(identifier, cmd_name)  # who, command
                     if rc[0]:  # who, command
@@ -844,7 +1503,7 @@ class ghbot(ircbot):
 
             cmd_idx   = self.find_key_in_list(splitted_args, 'cmd',   2)
 
-            if not identifier_is_known and target_type == 'user':
+            if not identifier_is_known and target_type == 'user' and not hostmask.is_pattern(check_user):
                 self.invoke_who_and_wait(check_user)
 
                 if check_user in self.users:
@@ -923,6 +1582,8 @@ class ghbot(ircbot):
             else:
                 self.send_error(channel, f'Meet parameter missing ({splitted_args} given)')
 
+            return self.internal_command_rc.HANDLED
+
         elif command == 'merge':
             if splitted_args != None and len(splitted_args) == 3:
                 new_nick = splitted_args[1].lower()
@@ -945,6 +1606,8 @@ class ghbot(ircbot):
             else:
                 self.send_error(channel, f'Meet parameter(s) missing ({splitted_args} given)')
 
+            return self.internal_command_rc.HANDLED
+
         elif command == 'commands':
             plugins = self.list_plugins()
 
@@ -954,12 +1617,8 @@ class ghbot(ircbot):
 
         elif command == 'define' or command == 'alias':
             if len(splitted_args) >= 3:
-                self.plugins_lock.acquire()
-
                 plugin_known = splitted_args[1] in self.plugins
 
-                self.plugins_lock.release()
-
                 if plugin_known:
                     self.send_error(channel, f'Cannot override internal/plugin commands')
 
@@ -1049,18 +1708,16 @@ class ghbot(ircbot):
             if len(splitted_args) == 2:
                 cmd = splitted_args[1]
 
-                self.plugins_lock.acquire()
+                record = self.plugins.get(cmd)
 
-                if cmd in self.plugins:
-                    self.send_ok(channel, f'Command {cmd}: {self.plugins[cmd][0]} (group: {self.plugins[cmd][1]})')
+                if record != None:
+                    self.send_ok(channel, f'Command {cmd}: {record.descr} (group: {record.acl_group}){" (not confirmed by its plugin yet)" if record.provisional else ""}')
 
                 else:
                     suggestions = set([x for x in self.similar_to(cmd) if x != None])
 
                     self.send_error(channel, f'Command/plugin not known (maybe {" or ".join(suggestions)}?)')
 
-                self.plugins_lock.release()
-
             else:
                 plugins = self.list_plugins()
 
@@ -1108,13 +1765,13 @@ class ghbot(ircbot):
                     self.invoke_who_and_wait(to_user)
 
                 if from_user in self.users and to_user in self.users and self.users[from_user] != '?' and self.users[to_user] != '?':
-                    error = self.clone_acls(self.users[from_user], self.users[to_user])
+                    rc = self.clone_acls(self.users[from_user], self.users[to_user])
 
-                    if error == None:
-                        self.send_ok(channel, f'User {from_} cloned (to {to_})')
+                    if rc[0]:
+                        self.send_ok(channel, f'User {from_} cloned (to {to_}): {rc[1]}')
 
                     else:
-                        self.send_error(channel, f'Cannot clone {from_} to {to_}: {error}')
+                        self.send_error(channel, f'Cannot clone {from_} to {to_}: {rc[1]}')
 
                 else:
                     self.send_error(channel, f'Either {from_} or {to_} is unknown')
@@ -1136,15 +1793,9 @@ class ghbot(ircbot):
                         groups.add(row[0])
 
                     # defined by plugins
-                    self.plugins_lock.acquire()
-
-                    for plugin in self.plugins:
-                        group = self.plugins[plugin][1]
-
-                        if group != None:
-                            groups.add(group)
-
-                    self.plugins_lock.release()
+                    for plugin, record in self.plugins.items():
+                        if record.acl_group != None:
+                            groups.add(record.acl_group)
 
                     groups_str = ', '.join(groups) if len(groups) > 1 else '(none)'
 
@@ -1171,14 +1822,10 @@ class ghbot(ircbot):
                             commands.add(row[0])
 
                         # defined by plugins
-                        self.plugins_lock.acquire()
-
-                        for plugin in self.plugins:
-                            if self.plugins[plugin][1] == group:
+                        for plugin, record in self.plugins.items():
+                            if record.acl_group == group:
                                 commands.add(plugin)
 
-                        self.plugins_lock.release()
-
                         commands_str = ', '.join(commands)
 
                         self.send_ok(channel, f'Commands in group {group}: {commands_str}')
@@ -1256,6 +1903,8 @@ class ghbot(ircbot):
 
             if which in self.local_plugins.list_plugins():
                 if self.local_plugins.reload_module(which):
+                    self.local_plugins_changed()
+
                     self.send_ok(channel, f'Local plugins {which} reloaded')
 
                     return self.internal_command_rc.HANDLED
@@ -1267,6 +1916,8 @@ class ghbot(ircbot):
         elif command == 'loadlp':
             which = self.local_plugins.load_modules()
 
+            self.local_plugins_changed()
+
             self.send_ok(channel, f'Done (loaded: {", ".join(which)})')
 
             return self.internal_command_rc.HANDLED
@@ -1287,6 +1938,84 @@ class ghbot(ircbot):
 
             return self.internal_command_rc.HANDLED
 
+        elif command == 'stats':
+            if self.stats == None:
+                self.send_error(channel, 'Statistics are not enabled')
+
+                return self.internal_command_rc.ERROR
+
+            try:
+                if len(splitted_args) >= 2:
+                    which = splitted_args[1].lower()
+
+                    rows  = self.stats.get_rows(which)
+
+                    per_outcome = ', '.join([f'{outcome}: {count}' for outcome, count in self.stats.top(rows, 3, 3)])
+                    per_account = ', '.join([f'{account[0:account.find("!")] if "!" in account else account} ({count})' for account, count in self.stats.top(rows, 2, 5)])
+
+                    self.send_ok(channel, f'Command {which}: {per_outcome if per_outcome != "" else "never used"}; most used by: {per_account}')
+
+                else:
+                    rows = self.stats.get_rows()
+
+                    top  = ', '.join([f'{cmd} ({count})' for cmd, count in self.stats.top(rows, 0, 15)])
+
+                    self.send_ok(channel, f'Most used commands: {top}')
+
+            except Exception as e:
+                self.send_error(channel, f'stats: exception "{e}" at line number: {e.__traceback__.tb_lineno}')
+
+            return self.internal_command_rc.HANDLED
+
+        elif command == 'importacls' or command == 'exportacls':
+            if len(splitted_args) != 2:
+                self.send_error(channel, f'Usage: {command} <file.json|file.csv>')
+
+                return self.internal_command_rc.ERROR
+
+            # only files in the dump-directory can be read/written
+            filename = os.path.basename(splitted_args[1])
+
+            fmt      = acl_bulk.format_from_name(filename)
+
+            if fmt == None:
+                self.send_error(channel, f'{command}: filename must end in .json or .csv')
+
+                return self.internal_command_rc.ERROR
+
+            full_name = os.path.join(self.acl_dump_dir, filename)
+
+            try:
+                if command == 'importacls':
+                    with open(full_name, 'r') as fh:
+                        acls, groups = acl_bulk.parse(fh.read(), fmt)
+
+                    ok, text = self.import_acls(acls, groups)
+
+                    if not ok:
+                        self.send_error(channel, text)
+
+                        return self.internal_command_rc.ERROR
+
+                    self.send_ok(channel, f'Imported {filename}: {text}')
+
+                else:
+                    acls, groups = self.export_acls()
+
+                    os.makedirs(self.acl_dump_dir, exist_ok=True)
+
+                    with open(full_name, 'w') as fh:
+                        fh.write(acl_bulk.dump(acls, groups, fmt))
+
+                    self.send_ok(channel, f'Exported {len(acls)} acls and {len(groups)} group memberships to {filename}')
+
+            except Exception as e:
+                self.send_error(channel, f'{command}: exception "{e}" at line number: {e.__traceback__.tb_lineno}')
+
+                return self.internal_command_rc.ERROR
+
+            return self.internal_command_rc.HANDLED
+
         elif self.local_plugins.process(prefix, (prefix, command, splitted_args, channel)):
             return self.internal_command_rc.HANDLED
 
@@ -1311,10 +2040,68 @@ class ghbot(ircbot):
 
     def irc_command_insertion_point(self, prefix, command, arguments):
         if command in [ 'JOIN', 'PART', 'KICK', 'NICK', 'QUIT' ]:
-            self.mqtt.publish(f'from/irc/{arguments[0][1:]}/{prefix}/{command}', ' '.join(arguments))
+            # for NICK and QUIT the first argument is the new nick or the quit message, not a channel
+            channel = arguments[0][1:] if command in [ 'JOIN', 'PART', 'KICK' ] else None
+
+            self.publish_event(command.lower(), channel, f'from/irc/{arguments[0][1:]}/{prefix}/{command}', ' '.join(arguments))
 
         return True
 
+    # the channel state depends on the order of the lines (e.g. a JOIN of
+    # the bot resets the members that the NAMES replies after it add) so it
+    # is updated in the reader thread instead of the per-line threads
+    def irc_command_received(self, prefix, command, arguments):
+        try:
+            self.update_channel_state(prefix, command, arguments)
+
+        except Exception as e:
+            print(f'irc_command_received: cannot update channel state for {command}: {e}')
+
+    def update_channel_state(self, prefix, command, arguments):
+        if self.channel_state == None:
+            return
+
+        nick = prefix.split('!')[0]
+
+        if command == 'JOIN':
+            if nick.lower() == self.nick.lower():
+                self.channel_state.reset(arguments[0][1:])
+
+                self.send(f'MODE {arguments[0]}')  # returns a 324
+
+            else:
+                self.channel_state.join(arguments[0][1:], nick)
+
+        elif command == 'PART':
+            self.channel_state.part(arguments[0][1:], nick)
+
+        elif command == 'KICK':
+            self.channel_state.part(arguments[0][1:], arguments[1], 'kick')
+
+        elif command == 'QUIT':
+            self.channel_state.quit(nick)
+
+        elif command == 'NICK':
+            self.channel_state.nick(nick, arguments[0])
+
+        elif command == 'TOPIC':
+            self.channel_state.topic(arguments[0][1:], arguments[1])
+
+        elif command == 'MODE' and arguments[0][0:1] == '#':
+            self.channel_state.modes(arguments[0][1:], arguments[1])
+
+        elif command == '332':  # topic
+            self.channel_state.topic(arguments[1][1:], arguments[2])
+
+        elif command == '353':  # names
+            self.channel_state.names(arguments[2][1:], arguments[3].split(' '))
+
+        elif command == '366':  # end of names
+            self.channel_state.names_end(arguments[1][1:])
+
+        elif command == '324':  # channel modes
+            self.channel_state.modes(arguments[1][1:], arguments[2], True)
+
 if len(sys.argv) != 2:
     print('Filename of configuration file required')
 
@@ -1326,15 +2113,49 @@ config.read(sys.argv[1])
 # host, user, password, database
 db = dbi(config['db']['host'], config['db']['user'], config['db']['password'], config['db']['database'])
 
-# broker_ip, topic_prefix
-m = mqtt_handler(config['mqtt']['host'], config['mqtt']['prefix'])
+# background writers get their own connection so that they never wait for (or delay) command processing
+db_bg = dbi(config['db']['host'], config['db']['user'], config['db']['password'], config['db']['database'])
+
+stats = command_stats(db_bg, config.getint('stats', 'flush_interval', fallback=60))
+
+# db, filename (None: store in database), queue_size, batch_size, drop_policy
+audit = audit_log(db_bg, config.get('audit', 'file', fallback=None), config.getint('audit', 'queue_size', fallback=10000), config.getint('audit', 'batch_size', fallback=500), config.get('audit', 'drop_policy', fallback='drop-newest'))
+
+# e.g. 'from/bot/=1, from/irc/=0'
+publish_qos = dict()
+
+for item in config.get('mqtt', 'publish_qos', fallback='').split(','):
+    if '=' in item:
+        topic, qos = item.split('=')
+
+        publish_qos[topic.strip()] = int(qos)
+
+# broker_ip, topic_prefix, n_workers, queue_size, overflow, publish_queue_size, publish_overflow, publish_qos
+m = mqtt_handler(config['mqtt']['host'], config['mqtt']['prefix'], config.getint('mqtt', 'dispatch_workers', fallback=4), config.getint('mqtt', 'dispatch_queue_size', fallback=1000), config.get('mqtt', 'dispatch_overflow', fallback='drop-oldest'), config.getint('mqtt', 'publish_queue_size', fallback=10000), config.get('mqtt', 'publish_overflow', fallback='drop-oldest'), publish_qos)
+
+# max_bytes, window
+cache = response_cache(config.getint('cache', 'max_bytes', fallback=1048576), config.getfloat('cache', 'window', fallback=2.)) if config.getboolean('cache', 'enabled', fallback=True) else None
+
+# window, min_samples, failure_ratio, slow_threshold, cool_down, max_cool_down
+breaker = circuit_breaker(config.getint('breaker', 'window', fallback=20), config.getint('breaker', 'min_samples', fallback=5), config.getfloat('breaker', 'failure_ratio', fallback=0.5), config.getfloat('breaker', 'slow_threshold', fallback=10.), config.getfloat('breaker', 'cool_down', fallback=30.), config.getfloat('breaker', 'max_cool_down', fallback=600.)) if config.getboolean('breaker', 'enabled', fallback=True) else None
+
+local_plugin_config = dict()
+local_plugin_config['workers']         = config.getint('plugins', 'workers', fallback=8)
+local_plugin_config['concurrency']     = config.getint('plugins', 'concurrency', fallback=2)
+local_plugin_config['timeout']         = config.getfloat('plugins', 'timeout', fallback=10.)
+local_plugin_config['process_workers'] = config.getint('plugins', 'process_workers', fallback=2)
+local_plugin_config['host_mode']       = config.get('plugins', 'host_mode', fallback='inprocess')
+local_plugin_config['rss_limit_mb']    = config.getint('plugins', 'rss_limit_mb', fallback=0)
+local_plugin_config['watch']           = config.get('plugins', 'watch', fallback='off')
+local_plugin_config['poll_interval']   = config.getfloat('plugins', 'poll_interval', fallback=5.)
 
 # host, port, nick, channel, m, db, command_prefix
-g = ghbot(config['irc']['host'], int(config['irc']['port']), config['irc']['nick'], config['irc']['password'], config['irc']['channels'].split(','), m, db, config['irc']['prefix'], 'plugins')
+g = ghbot(config['irc']['host'], int(config['irc']['port']), config['irc']['nick'], config['irc']['password'], config['irc']['channels'].split(','), m, db, config['irc']['prefix'], 'plugins', stats, audit, config.getboolean('mqtt', 'interest_filter', fallback=False), config.get('plugins', 'registry_file', fallback=None), config.getint('plugins', 'register_jitter', fallback=5), channel_state(m, config.getint('irc', 'state_refresh_interval', fallback=300)), local_plugin_config, cache, config.getfloat('correlation', 'slow_after', fallback=5.), config.getfloat('correlation', 'timeout', fallback=30.), breaker)
 
 ka = irc_keepalive(g)
 
-h = http_server(8000, g)
+# /acls.json, /acls.csv and /acls-import.cgi need this token (without one: localhost only)
+h = http_server(8000, g, config.get('http', 'acl_token', fallback=None))
 
 print('Go!')
 
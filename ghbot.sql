@@ -20,3 +20,25 @@ CREATE TABLE `aliasses` (
   PRIMARY KEY (`nr`),
   KEY `command` (`command`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `command_stats` (
+  `command` varchar(64) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `channel` varchar(64) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `account` varchar(256) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `outcome` enum('granted','denied','unknown') NOT NULL,
+  `count` bigint(20) NOT NULL DEFAULT 0,
+  `last_seen` datetime NOT NULL,
+  PRIMARY KEY (`command`,`channel`,`account`,`outcome`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+CREATE TABLE `audit_log` (
+  `nr` bigint(20) NOT NULL AUTO_INCREMENT,
+  `ts` datetime NOT NULL,
+  `kind` varchar(16) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `actor` varchar(256) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `action` varchar(256) COLLATE utf8mb4_unicode_ci NOT NULL,
+  `target` varchar(512) COLLATE utf8mb4_unicode_ci DEFAULT NULL,
+  `result` varchar(64) COLLATE utf8mb4_unicode_ci DEFAULT NULL,
+  PRIMARY KEY (`nr`),
+  KEY `ts` (`ts`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
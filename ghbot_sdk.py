@@ -0,0 +1,248 @@
+#! /usr/bin/python3
+
+# helper for writing MQTT plugins for GHBot in Python:
+#
+#   plugin = ghbot_plugin('weather', '192.168.64.1', author='Flok', location='nurdspace')
+#
+#   @plugin.command(descr='Show the weather: weather <city>', cache=300)
+#   async def weather(ctx):
+#       await ctx.reply(f'{ctx.nick}: sunny in {" ".join(ctx.args)}')
+#
+#   plugin.run()
+#
+# it registers the commands (v2 format) when connected and whenever the bot
+# asks for it (spread over the register-jitter the bot announces), sends a
+# heartbeat that keeps all commands alive, runs handlers in an asyncio loop
+# (at most `concurrency` at the same time; plain functions go to a thread)
+# and splits replies so that they fit in an IRC line.
+
+import asyncio
+import json
+import paho.mqtt.client as mqtt
+import random
+import time
+
+
+class command_context:
+    def __init__(self, plugin, channel, prefix, command, text, corr):
+        self.plugin  = plugin
+        self.channel = channel  # without '#'; '\nick' for a private message
+        self.prefix  = prefix   # nick!user@host
+        self.nick    = prefix.split('!')[0]
+        self.command = command
+        self.text    = text     # the complete line, including command prefix and command
+        self.args    = text.split()[1:]
+        self.corr    = corr     # correlation id or None
+
+    def is_private(self):
+        return self.channel[0:1] == '\\'
+
+    async def reply(self, text):
+        self.plugin.send(self, 'privmsg', text)
+
+    async def notice(self, text):
+        self.plugin.send(self, 'notice', text)
+
+class ghbot_plugin:
+    line_limit = 450  # longer texts are split by the bot into 'more' parts
+
+    def __init__(self, name, broker, topic_prefix='', port=1883, author='', location='', concurrency=4, heartbeat_interval=4., correlation=False, max_lines=3):
+        self.name               = name
+        self.topic_prefix       = topic_prefix
+        self.author             = author
+        self.location           = location
+        self.concurrency        = concurrency
+        self.heartbeat_interval = heartbeat_interval  # the bot forgets commands after 10 seconds without one
+        self.correlation        = correlation
+        self.max_lines          = max_lines
+
+        self.commands           = dict()  # command -> (handler, registration dict)
+
+        self.cmd_prefix         = '!'
+        self.register_jitter    = 0.
+        self.register_pending   = False
+        self.registered         = False
+
+        self.loop               = None
+        self.semaphore          = None
+
+        self.broker             = broker
+        self.port               = port
+
+        self.client = mqtt.Client()
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+
+    # decorator; name defaults to the name of the function
+    def command(self, name=None, descr='', acl_group=None, cache=0, deadline=None):
+        def register(handler):
+            cmd = name if name != None else handler.__name__
+
+            registration = { 'cmd': cmd, 'descr': descr }
+
+            if acl_group != None:
+                registration['agrp'] = acl_group
+
+            if cache > 0:
+                registration['cache'] = cache
+
+            if self.correlation:
+                registration['correlation'] = True
+
+                if deadline != None:
+                    registration['deadline'] = deadline
+
+            self.commands[cmd] = (handler, registration)
+
+            return handler
+
+        return register
+
+    # splits text at spaces into at most max_lines parts of at most limit characters
+    @staticmethod
+    def split_text(text, limit, max_lines):
+        out = []
+
+        while len(text) > limit and len(out) < max_lines - 1:
+            space = text.rfind(' ', 0, limit + 1)
+
+            if space <= 0:
+                space = limit
+
+            out.append(text[0:space].strip())
+
+            text = text[space:].strip()
+
+        if len(text) > limit:
+            text = text[0:limit - 4].rstrip() + ' ...'
+
+        if text != '':
+            out.append(text)
+
+        return out
+
+    def publish(self, topic, payload, retain=False):
+        self.client.publish(self.topic_prefix + topic, payload, retain=retain)
+
+    # kind is 'privmsg' or 'notice'
+    def send(self, ctx, kind, text):
+        if ctx.is_private():
+            topic = f'to/irc/{ctx.channel}'  # no notices in private
+
+        else:
+            topic = f'to/irc/{ctx.channel}/{kind}'
+
+        if ctx.corr != None:
+            topic += f'/{ctx.corr}'
+
+        for line in ghbot_plugin.split_text(text.replace('\r', ' ').replace('\n', ' '), ghbot_plugin.line_limit, self.max_lines):
+            self.publish(topic, line)
+
+    def _register(self):
+        self.register_pending = False
+
+        msg = { 'v': 2, 'plugin': self.name, 'athr': self.author, 'loc': self.location, 'commands': [registration for handler, registration in self.commands.values()] }
+
+        self.publish('to/bot/register', json.dumps(msg))
+
+        self.registered = True
+
+    # invoked in the asyncio loop
+    def _schedule_register(self, jitter):
+        if self.register_pending:
+            return
+
+        self.register_pending = True
+
+        self.loop.call_later(random.uniform(0, jitter), self._register)
+
+    # invoked by the paho thread
+    def _on_connect(self, client, userdata, flags, rc):
+        for topic in ('from/bot/command', f'from/bot/plugin/{self.name}/command', 'from/bot/parameter/#', 'from/irc/#'):
+            self.client.subscribe(self.topic_prefix + topic)
+
+        self.loop.call_soon_threadsafe(self._schedule_register, 0)
+
+    # invoked by the paho thread
+    def _on_message(self, client, userdata, msg):
+        self.loop.call_soon_threadsafe(self._process, msg.topic[len(self.topic_prefix):], msg.payload.decode('utf-8', 'replace'))
+
+    # invoked in the asyncio loop
+    def _process(self, topic, payload):
+        parts = topic.split('/')
+
+        if topic == 'from/bot/command' or topic == f'from/bot/plugin/{self.name}/command':
+            if payload == 'register':
+                self._schedule_register(self.register_jitter)
+
+        elif topic == 'from/bot/parameter/prefix':
+            self.cmd_prefix = payload
+
+        elif topic == 'from/bot/parameter/register-jitter':
+            self.register_jitter = float(payload)
+
+        elif len(parts) >= 5 and parts[0] == 'from' and parts[1] == 'irc' and parts[-1] in self.commands:
+            # from/irc/<channel>/<nick!user@host>/<command>; the host may contain '/'
+            command = parts[-1]
+
+            corr    = None
+
+            if payload[0:1] == '{':
+                data    = json.loads(payload)
+
+                corr    = data['corr']
+                payload = data['text']
+
+            # not a command, e.g. a channel message when a command is called 'message'
+            if payload[0:len(self.cmd_prefix)] != self.cmd_prefix or payload[len(self.cmd_prefix):].split(' ')[0] != command:
+                return
+
+            ctx = command_context(self, parts[2], '/'.join(parts[3:-1]), command, payload, corr)
+
+            self.loop.create_task(self._invoke(self.commands[command][0], ctx))
+
+    async def _invoke(self, handler, ctx):
+        async with self.semaphore:
+            try:
+                if asyncio.iscoroutinefunction(handler):
+                    await handler(ctx)
+
+                else:
+                    await self.loop.run_in_executor(None, handler, ctx)
+
+            except Exception as e:
+                print(f'ghbot_plugin::_invoke: exception "{e}" at line number: {e.__traceback__.tb_lineno} while processing {ctx.text}')
+
+                await ctx.reply(f'{ctx.command}: internal error')
+
+    async def _main(self):
+        self.loop      = asyncio.get_running_loop()
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        self.client.connect(self.broker, self.port, 60)
+        self.client.loop_start()  # paho runs its own thread and hands messages over to the loop
+
+        # one message keeps all commands of this plugin alive
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+
+            if self.registered:
+                self.publish('to/bot/register', json.dumps({ 'v': 2, 'heartbeat': self.name }))
+
+    def run(self):
+        asyncio.run(self._main())
+
+if __name__ == "__main__":
+    plugin = ghbot_plugin('sdk-example', '127.0.0.1', author='Flok', location='ghbot_sdk.py')
+
+    @plugin.command(descr='Repeat the arguments: echo <text>', cache=60)
+    async def echo(ctx):
+        await ctx.reply(f'{ctx.nick}: {" ".join(ctx.args)}')
+
+    @plugin.command(descr='Wait a bit and reply')
+    def slow(ctx):
+        time.sleep(2)
+
+        plugin.send(ctx, 'privmsg', f'{ctx.nick}: done')
+
+    plugin.run()
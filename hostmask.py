@@ -0,0 +1,150 @@
+#! /usr/bin/python3
+
+# matches nick!user@host prefixes against wildcard hostmasks (e.g.
+# *!*@nurdspace/* or nick!*@*.example)
+#
+# all patterns are compiled into a set of indexes so that only a handful of
+# candidates need to be checked for a prefix:
+# - literal tail of the host (*!*@*.example -> '.example')
+# - literal head of the host (*!*@nurdspace/* -> 'nurdspace/')
+# - literal head of the nick (nick!*@* -> 'nick')
+# patterns that have none of these end up in a (hopefully small) generic list
+
+import re
+import threading
+
+
+separators = re.compile(r'[./:]')
+
+def is_pattern(subject):
+    return subject != None and ('*' in subject or '?' in subject)
+
+def _first_wildcard(s):
+    indexes = [i for i in (s.find('*'), s.find('?')) if i != -1]
+
+    return min(indexes) if len(indexes) > 0 else -1
+
+def _last_wildcard(s):
+    return max(s.rfind('*'), s.rfind('?'))
+
+# IRC masks only know '*' and '?': everything else (e.g. '[' and '\\' which
+# are common in nicks) is literal
+def _translate(pattern):
+    return ''.join(['.*' if c == '*' else '.' if c == '?' else re.escape(c) for c in pattern]) + r'\Z'
+
+def _split_prefix(prefix):
+    excl_mark = prefix.find('!')
+    at_sign   = prefix.rfind('@')
+
+    nick = prefix[0:excl_mark] if excl_mark != -1 else prefix
+    host = prefix[at_sign + 1:] if at_sign != -1 else ''
+
+    return nick, host
+
+class hostmask_matcher:
+    def __init__(self):
+        self.lock  = threading.Lock()
+
+        self.index = self._build([])
+
+    def _build(self, patterns):
+        index = dict()
+        index['host_suffix'] = dict()
+        index['host_prefix'] = dict()
+        index['nick_prefix'] = dict()
+        index['generic']     = []
+        index['count']       = 0
+
+        for pattern in set(patterns):
+            if not is_pattern(pattern):
+                continue
+
+            pattern = pattern.lower()
+
+            entry = (pattern, re.compile(_translate(pattern), re.IGNORECASE | re.DOTALL))
+
+            nick, host = _split_prefix(pattern)
+
+            index['count'] += 1
+
+            # literal tail of the host starting at a separator, e.g. '.example' of '*.example'
+            last_wc = _last_wildcard(host)
+
+            if last_wc == -1 and len(host) > 0:
+                index['host_suffix'].setdefault(host, []).append(entry)
+
+                continue
+
+            tail    = host[last_wc + 1:]
+            tail_m  = separators.search(tail)
+
+            if tail_m != None and tail_m.start() < len(tail) - 1:
+                index['host_suffix'].setdefault(tail[tail_m.start():], []).append(entry)
+
+                continue
+
+            # literal head of the host up to a separator, e.g. 'nurdspace/' of 'nurdspace/*'
+            head    = host[0:_first_wildcard(host)]
+            head_m  = list(separators.finditer(head))
+
+            if len(head_m) > 0 and head_m[-1].start() > 0:
+                index['host_prefix'].setdefault(head[0:head_m[-1].end()], []).append(entry)
+
+                continue
+
+            nick_wc = _first_wildcard(nick)
+            head    = nick[0:nick_wc] if nick_wc != -1 else nick
+
+            if len(head) > 0:
+                index['nick_prefix'].setdefault(head, []).append(entry)
+
+                continue
+
+            index['generic'].append(entry)
+
+        return index
+
+    # replaces all patterns at once; lookups in progress keep using the
+    # previous set
+    def compile(self, patterns):
+        index = self._build(patterns)
+
+        with self.lock:
+            self.index = index
+
+    def __len__(self):
+        return self.index['count']
+
+    # returns the patterns that match prefix
+    def match(self, prefix):
+        index = self.index
+
+        if index['count'] == 0 or prefix == None:
+            return []
+
+        prefix     = prefix.lower()
+
+        nick, host = _split_prefix(prefix)
+
+        candidates = []
+        candidates += index['host_suffix'].get(host, [])
+
+        for m in separators.finditer(host):
+            candidates += index['host_suffix'].get(host[m.start():], [])
+            candidates += index['host_prefix'].get(host[0:m.end()], [])
+
+        for i in range(1, len(nick) + 1):
+            candidates += index['nick_prefix'].get(nick[0:i], [])
+
+        candidates += index['generic']
+
+        return [pattern for pattern, compiled in candidates if compiled.match(prefix)]
+
+    # the pattern with the most literal characters is considered the most specific one
+    def best_match(self, prefix):
+        matching = self.match(prefix)
+
+        if len(matching) == 0:
+            return None
+
+        return max(matching, key=lambda p: len(p) - p.count('*') - p.count('?'))
@@ -1,15 +1,120 @@
 #! /usr/bin/python3
 
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import acl_bulk
+import hashlib
+import hmac
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
 import pickle
-import socketserver
 import threading
 import time
 from urllib.parse import parse_qs
 
 
 class http_requesthandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive; every response needs a Content-Length
+
+    timeout          = 30  # seconds an idle keep-alive connection may hold a thread
+
+    ka_bucket        = 5   # seconds that latest_ka values in a cached page may be old
+
+    def _reply(self, code, content_type, body):
+        if isinstance(body, str):
+            body = bytes(body, 'utf8')
+
+        self.send_response(code)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    # sends a 304 when the client has this version already
+    def _reply_etag(self, content_type, body, etag=None):
+        if isinstance(body, str):
+            body = bytes(body, 'utf8')
+
+        if etag == None:
+            etag = '"' + hashlib.sha1(body).hexdigest()[0:20] + '"'
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+            return
+
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    # pages are rendered again only when key changes (e.g. the registry version)
+    def _reply_cached(self, path, key, content_type, render):
+        with self.server.page_cache_lock:
+            entry = self.server.page_cache.get(path)
+
+        if entry == None or entry[0] != key:
+            body  = bytes(render(), 'utf8')
+
+            entry = (key, '"' + hashlib.sha1(body).hexdigest()[0:20] + '"', body)
+
+            with self.server.page_cache_lock:
+                self.server.page_cache[path] = entry
+
+        self._reply_etag(content_type, entry[2], entry[1])
+
+    # the ACL endpoints (and the accounts in the stats): with a token
+    # configured the client must send 'Authorization: Bearer <token>', else
+    # only localhost may use them
+    def _acl_access(self):
+        token = self.server.acl_token
+
+        if token == None or token == '':
+            return self.client_address[0] in ('127.0.0.1', '::1', '::ffff:127.0.0.1')
+
+        return hmac.compare_digest(self.headers.get('Authorization', '').encode('utf-8'), f'Bearer {token}'.encode('utf-8'))
+
+    def _render_index(self, snapshot):
+        page = ['<html>', '<head><title>GHBot</title></head>', '<body>', '<h1>GHbot</h1>']
+
+        page.append('<h2>loaded plugins</h2>')
+        page.append('<table>')
+        page.append('<tr><th>command</th><th>group</th><th>author</th><th>location</th></tr>')
+        page.append('<tr><th colspan=4>description</th></tr>')
+
+        for p, record in snapshot.plugins.items():
+            page.append(f'<tr><td>{p}</td><td>{record.acl_group}</td><td>{record.author}</td><td>{record.location}</td></tr>')
+            page.append(f'<tr><td colspan=4>{record.descr}</td></tr>')
+
+        page.append('</table>')
+
+        page.append('</body>')
+        page.append('</html>')
+
+        return ''.join(page)
+
+    def _render_plugins_loaded(self, registry, snapshot):
+        plugins = []
+
+        for p, record in snapshot.plugins.items():
+            record_out = dict()
+            record_out['command']   = p
+            record_out['descr']     = record.descr
+            record_out['acl_group'] = record.acl_group
+            record_out['latest_ka'] = registry.latest_ka(p)
+            record_out['author']    = record.author
+            record_out['location']  = record.location
+            record_out['provisional'] = record.provisional
+
+            plugins.append(record_out)
+
+        return json.dumps(plugins)
+
     def do_GET(self):
         p = self.path
 
@@ -17,63 +122,63 @@ class http_requesthandler(BaseHTTPRequestHandler):
             p = p[0:p.find('?')]
 
         if p == '/index.html' or p == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
+            snapshot = self.server.context_data.registry.current()
 
-            page  = '<html>'
-            page += '<head><title>GHBot</title></head>'
-            page += '<body>'
-            page += '<h1>GHbot</h1>'
+            self._reply_cached('/index.html', snapshot.version, 'text/html', lambda: self._render_index(snapshot))
 
-            page += '<h2>loaded plugins</h2>'
-            page += '<table>'
-            page += '<tr><th>command</th><th>group</th><th>author</th><th>location</th></tr>'
-            page += '<tr><th colspan=4>description</th></tr>'
+        elif p == '/plugins-loaded.cgi':
+            registry = self.server.context_data.registry
 
-            for p in self.server.context_data.plugins:
-                record = self.server.context_data.plugins[p]
+            snapshot = registry.current()
 
-                # [descr, acl_group, time.time(), athr, location]
+            self._reply_cached(p, (snapshot.version, int(time.time() / http_requesthandler.ka_bucket)), 'application/json', lambda: self._render_plugins_loaded(registry, snapshot))
 
-                page += f'<tr><td>{p}</td><td>{record[1]}</td><td>{record[3]}</td><td>{record[4]}</td></tr>'
-                page += f'<tr><td colspan=4>{record[0]}</td></tr>'
+        elif p == '/stats.cgi':
+            stats = self.server.context_data.stats
 
-            page += '</table>'
+            rows = stats.get_rows() if stats != None else []
 
-            page += '</body>'
-            page += '</html>'
+            if self._acl_access():
+                out = [{ 'command': row[0], 'channel': row[1], 'account': row[2], 'outcome': row[3], 'count': row[4] } for row in rows]
 
-            self.wfile.write(bytes(page, 'utf8'))
+            else:
+                # who used which command is only for the ones that may see the ACLs
+                totals = dict()
 
-        elif p == '/plugins-loaded.cgi':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
+                for row in rows:
+                    totals[(row[0], row[1], row[3])] = totals.get((row[0], row[1], row[3]), 0) + row[4]
 
-            plugins = []
+                out = [{ 'command': key[0], 'channel': key[1], 'outcome': key[2], 'count': count } for key, count in totals.items()]
 
-            for p in self.server.context_data.plugins:
-                record = self.server.context_data.plugins[p]
+            self._reply_etag('application/json', json.dumps(out))
 
-                record_out = dict()
-                record_out['command']   = p
-                record_out['descr']     = record[0]
-                record_out['acl_group'] = record[1]
-                record_out['latest_ka'] = record[2]
-                record_out['author']    = record[3]
-                record_out['location']  = record[4]
+        elif p == '/routes.cgi':
+            out = dict()
+            out['routes']   = self.server.context_data.get_route_stats()
+            out['dispatch'] = self.server.context_data.mqtt.pool.get_stats()
+            out['publish']  = self.server.context_data.mqtt.publisher.get_counters()
+            out['triggers'] = self.server.context_data.triggers.get_stats()
+            out['local_plugins'] = self.server.context_data.local_plugins.get_stats()
+            out['response_cache'] = self.server.context_data.response_cache.get_stats() if self.server.context_data.response_cache != None else None
+            out['latency']  = self.server.context_data.pending.get_stats()
+            out['breakers'] = self.server.context_data.breaker.get_stats() if self.server.context_data.breaker != None else None
+            with self.server.context_data.n_suppressed_lock:
+                out['interest'] = { 'filter': self.server.context_data.interest_filter, 'suppressed': dict(self.server.context_data.n_suppressed) }
 
-                plugins.append(record_out)
+            self._reply_etag('application/json', json.dumps(out))
 
-            self.wfile.write(bytes(json.dumps(plugins), 'utf8'))
+        elif (p == '/acls.json' or p == '/acls.csv') and not self._acl_access():
+            self._reply(403, 'text/plain', 'Not allowed')
 
-        else:
-            self.send_response(404)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
+        elif p == '/acls.json' or p == '/acls.csv':
+            fmt = acl_bulk.format_from_name(p)
+
+            acls, groups = self.server.context_data.export_acls()
 
-            self.wfile.write(bytes('nope', 'utf8'))
+            self._reply_etag('application/json' if fmt == 'json' else 'text/csv', acl_bulk.dump(acls, groups, fmt))
+
+        else:
+            self._reply(404, 'text/html', 'nope')
 
 
     def do_POST(self):
@@ -88,43 +193,57 @@ class http_requesthandler(BaseHTTPRequestHandler):
             if 'channel' in parsed_input and 'text' in parsed_input:
                 self.server.context_data.send_ok(parsed_input['channel'], parsed_input['text'])
 
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-
-                self.wfile.write(bytes('ok', 'utf8'))
+                self._reply(200, 'text/html', 'ok')
 
             else:
-                self.send_response(500)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
+                self._reply(500, 'text/html', 'Parameter(s) missing')
 
-                self.wfile.write(bytes('Parameter(s) missing', 'utf8'))
+        elif p == '/acls-import.cgi' and not self._acl_access():
+            self._reply(403, 'text/plain', 'Not allowed')
 
-        else:
-            self.send_response(404)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
+        elif p == '/acls-import.cgi':
+            content_len = int(self.headers['Content-Length'])
+            utf8_body = self.rfile.read(content_len).decode('utf8')
+
+            content_type = self.headers.get('Content-Type', '')
+            fmt = 'csv' if 'csv' in content_type else 'json'
 
-            self.wfile.write(bytes('nope', 'utf8'))
+            try:
+                acls, groups = acl_bulk.parse(utf8_body, fmt)
+
+                ok, text = self.server.context_data.import_acls(acls, groups, f'http:{self.client_address[0]}')
+
+            except Exception as e:
+                ok, text = False, f'Cannot parse {fmt}: {e}'
+
+            self._reply(200 if ok else 500, 'text/plain', text)
+
+        else:
+            self._reply(404, 'text/html', 'nope')
 
 class http_server(threading.Thread):
-    def __init__(self, port, ghbot):
+    def __init__(self, port, ghbot, acl_token=None):
         super().__init__()
 
-        self.ghbot = ghbot
-        self.port  = port
+        self.ghbot     = ghbot
+        self.port      = port
+        self.acl_token = acl_token
 
         self.name = 'GHBot HTTP'
         self.start()
 
     def run(self):
-        socketserver.TCPServer.allow_reuse_address = True
+        ThreadingHTTPServer.allow_reuse_address = True
 
         while True:
-            server = socketserver.TCPServer(('', self.port), http_requesthandler)
+            # a thread per connection: a slow client does not hold up the others
+            server = ThreadingHTTPServer(('', self.port), http_requesthandler)
+
+            server.context_data    = self.ghbot
+            server.acl_token       = self.acl_token
 
-            server.context_data = self.ghbot
+            server.page_cache      = dict()  # path -> (key, etag, body)
+            server.page_cache_lock = threading.Lock()
 
             server.serve_forever()
 
@@ -208,6 +208,21 @@ class ircbot(threading.Thread):
     def invoke_internal_commands(self, prefix, command, splitted_args, channel):
         return self.internal_command_rc.NOT_INTERNAL
 
+    # event is 'message', 'notice', 'topic', 'join', 'part', 'kick', 'nick' or 'quit'
+    def publish_event(self, event, channel, topic, payload):
+        self.mqtt.publish(topic, payload)
+
+    def check_triggers(self, channel, prefix, text):
+        pass
+
+    # channel is None for commands in a private message
+    def publish_command(self, channel, prefix, command, text, topic):
+        self.mqtt.publish(topic, text)
+
+    # outcome is 'granted', 'denied' or 'unknown'
+    def count_command(self, command, channel, prefix, outcome):
+        pass
+
     def handle_irc_commands(self, prefix, command, args):
         if len(command) == 3 and command.isnumeric():
             if command == '001':
@@ -230,7 +245,7 @@ class ircbot(threading.Thread):
             elif command == '331' or command == '332':  # no topic set / topic
                 self.topics[args[1][1:]] = args[2]
 
-                self.mqtt.publish(f'from/irc/{args[1][1:]}/topic', args[2])
+                self.publish_event('topic', args[1][1:], f'from/irc/{args[1][1:]}/topic', args[2])
 
             # 315 is 'end of who'
             if command == '352' or command == '315':
@@ -325,6 +340,8 @@ class ircbot(threading.Thread):
                     command = parts[0]
 
                     if not command in self.plugins:
+                        self.count_command(command, channel, prefix, 'unknown')
+
                         nick = prefix.split('!')[0].lower()
 
                         method = self.send_error_notice
@@ -350,6 +367,8 @@ class ircbot(threading.Thread):
 
                         response_channel = (prefix[0:prefix.find('!')] if '!' in prefix else prefix) if channel == self.nick else channel
 
+                        self.count_command(command, channel, prefix, 'granted' if access_granted else 'denied')
+
                         if access_granted:
                             # returns False when the command is not internal
                             rc = self.invoke_internal_commands(prefix, command, parts, channel)
@@ -364,10 +383,10 @@ class ircbot(threading.Thread):
                                     if '!' in person:
                                         person = person[0:person.find('!')]
 
-                                    self.mqtt.publish(f'from/irc/\\{person}/{prefix}/{command}', text)
+                                    self.publish_command(None, prefix, command, text, f'from/irc/\\{person}/{prefix}/{command}')
 
                                 else:
-                                    self.mqtt.publish(f'from/irc/{channel[1:]}/{prefix}/{command}', text)
+                                    self.publish_command(channel[1:], prefix, command, text, f'from/irc/{channel[1:]}/{prefix}/{command}')
 
                             elif rc == self.internal_command_rc.ERROR:
                                 pass
@@ -379,16 +398,22 @@ class ircbot(threading.Thread):
                             self.send_error(response_channel, f'Command "{command}" denied for user "{prefix}", one must be in {group_for_command}')
 
                 else:
-                    self.mqtt.publish(f'from/irc/{channel[1:]}/{prefix}/message', args[1])
+                    self.check_triggers(channel[1:], prefix, args[1])
+
+                    self.publish_event('message', channel[1:], f'from/irc/{channel[1:]}/{prefix}/message', args[1])
 
         elif command == 'NOTICE':
             if len(args) >= 2:
-                self.mqtt.publish(f'from/irc/{args[0][1:]}/{prefix}/notice', args[1])
+                self.publish_event('notice', args[0][1:], f'from/irc/{args[0][1:]}/{prefix}/notice', args[1])
 
         elif command == 'TOPIC':
             self.topics[args[0][1:]] = args[1]
 
-            self.mqtt.publish(f'from/irc/{args[0][1:]}/topic', args[1])
+            self.publish_event('topic', args[0][1:], f'from/irc/{args[0][1:]}/topic', args[1])
+
+        elif command == 'MODE':
+            # channel modes are tracked in irc_command_received
+            pass
 
         elif command == 'INVITE':
             # do not enter any channel, only the selected
@@ -404,6 +429,11 @@ class ircbot(threading.Thread):
     def irc_command_insertion_point(self, prefix, command, arguments):
         return True
 
+    # invoked in the reader thread, in the order in which the lines arrive;
+    # must not block
+    def irc_command_received(self, prefix, command, arguments):
+        pass
+
     def handle_irc_command_thread_wrapper(self, prefix, command, arguments):
         try:
             if self.irc_command_insertion_point(prefix, command, arguments):
@@ -503,6 +533,12 @@ class ircbot(threading.Thread):
 
                 prefix, command, arguments = self.parse_irc_line(line)
 
+                try:
+                    self.irc_command_received(prefix, command, arguments)
+
+                except Exception as e:
+                    print(f'irc::run: exception "{e}" while processing IRC command "{command}" at line number: {e.__traceback__.tb_lineno}')
+
                 t = threading.Thread(target=self.handle_irc_command_thread_wrapper, args=(prefix, command, arguments), daemon=True)
                 t.name = 'GHBot input'
                 t.start()
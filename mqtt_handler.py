@@ -1,22 +1,335 @@
 #! /usr/bin/python3
 
+import collections
 import paho.mqtt.client as mqtt
 import threading
 import time
+import zlib
 
 
+# subscriptions stored per topic level, with the MQTT wildcards:
+# '+' matches exactly one level, '#' (last level only) matches zero or more
+# levels. A lookup walks at most three branches ('literal', '+', '#') per level.
+class topic_trie:
+    class node:
+        __slots__ = ('children', 'handlers')
+
+        def __init__(self):
+            self.children = dict()
+            self.handlers = []
+
+    def __init__(self):
+        self.root = topic_trie.node()
+
+    def add(self, topic, handler):
+        current = self.root
+
+        for level in topic.split('/'):
+            if not level in current.children:
+                current.children[level] = topic_trie.node()
+
+            current = current.children[level]
+
+        current.handlers.append((topic, handler))
+
+    # returns [(specificity, subscription, handler), ...]; specificity is a
+    # tuple per level: 2 for a literal match, 1 for '+' and 0 for '#', ending
+    # in 3 when the subscription covers the topic without '#'
+    def match(self, topic):
+        levels = topic.split('/')
+
+        out    = []
+
+        self._match(self.root, levels, 0, (), out)
+
+        return out
+
+    def _match(self, current, levels, idx, specificity, out):
+        # '#' also matches the parent level ('a/#' matches 'a')
+        hash_node = current.children.get('#')
+
+        if hash_node != None:
+            for subscription, handler in hash_node.handlers:
+                out.append((specificity + (0,), subscription, handler))
+
+        if idx == len(levels):
+            for subscription, handler in current.handlers:
+                out.append((specificity + (3,), subscription, handler))
+
+            return
+
+        literal = current.children.get(levels[idx])
+
+        if literal != None:
+            self._match(literal, levels, idx + 1, specificity + (2,), out)
+
+        plus = current.children.get('+')
+
+        if plus != None:
+            self._match(plus, levels, idx + 1, specificity + (1,), out)
+
+    # the most specific subscription; literal levels win from wildcards,
+    # earlier levels weigh more than later ones
+    def best_match(self, topic):
+        matches = self.match(topic)
+
+        if len(matches) == 0:
+            return None
+
+        return max(matches, key=lambda m: m[0])
+
+# runs the message handlers outside of the paho network loop; a topic always
+# goes to the same worker so that messages for a topic are handled in order
+class dispatch_pool:
+    overflow_policies = ('drop-newest', 'drop-oldest', 'block')
+
+    class worker(threading.Thread):
+        def __init__(self, pool, nr):
+            super().__init__()
+
+            self.pool  = pool
+
+            self.queue = collections.deque()
+            self.cond  = threading.Condition()
+
+            self.name = f'GHBot MQTT dispatch {nr}'
+            self.start()
+
+        def run(self):
+            while True:
+                with self.cond:
+                    while len(self.queue) == 0:
+                        self.cond.wait()
+
+                    topic, subscription, handler, payload = self.queue.popleft()
+
+                    self.cond.notify_all()  # for the 'block' policy
+
+                start = time.time()
+
+                try:
+                    handler(topic, payload.decode('utf-8'))
+
+                except Exception as e:
+                    print(f'dispatch_pool::run: handler for "{topic}" failed: {e}')
+
+                self.pool.account(subscription, time.time() - start)
+
+    def __init__(self, n_workers, queue_size, overflow):
+        if not overflow in dispatch_pool.overflow_policies:
+            raise ValueError(f'dispatch_pool: overflow policy must be one of {", ".join(dispatch_pool.overflow_policies)}')
+
+        self.queue_size = queue_size
+        self.overflow   = overflow
+
+        self.stats      = dict()  # subscription -> [count, total time, max time]
+        self.n_dropped  = 0
+        self.lock       = threading.Lock()
+
+        self.workers    = [dispatch_pool.worker(self, i) for i in range(n_workers)]
+
+    def submit(self, topic, subscription, handler, payload):
+        w = self.workers[zlib.crc32(topic.encode('utf-8')) % len(self.workers)]
+
+        with w.cond:
+            if len(w.queue) >= self.queue_size:
+                if self.overflow == 'block':
+                    # note: this stalls the network loop (and thus keepalives)
+                    while len(w.queue) >= self.queue_size:
+                        w.cond.wait()
+
+                else:
+                    with self.lock:
+                        self.n_dropped += 1
+
+                    if self.overflow == 'drop-newest':
+                        print(f'dispatch_pool::submit: queue full, dropping message for "{topic}"')
+
+                        return
+
+                    w.queue.popleft()
+
+            w.queue.append((topic, subscription, handler, payload))
+
+            w.cond.notify_all()
+
+    def account(self, subscription, took):
+        with self.lock:
+            stats = self.stats.get(subscription)
+
+            if stats == None:
+                self.stats[subscription] = [1, took, took]
+
+            else:
+                stats[0] += 1
+                stats[1] += took
+                stats[2]  = max(stats[2], took)
+
+    def get_stats(self):
+        with self.lock:
+            out = dict()
+            out['dropped']       = self.n_dropped
+            out['queue_depths']  = [len(w.queue) for w in self.workers]
+            out['subscriptions'] = { subscription: { 'count': stats[0], 'avg_ms': stats[1] * 1000. / stats[0], 'max_ms': stats[2] * 1000. } for subscription, stats in self.stats.items() }
+
+            return out
+
+# decouples the publishers (e.g. the IRC handling) from the broker: publish()
+# only queues, a thread feeds the queue to the paho client which sends it
+# from its network loop. at most max_inflight messages are handed to paho
+# before it reports them as sent (paho's own buffer is unbounded) and
+# nothing is handed over while the connection is down: the messages stay in
+# this bounded queue so that the overflow policy applies.
+class publish_queue(threading.Thread):
+    overflow_policies = ('drop-oldest', 'block')
+
+    retry_interval    = 0.5  # seconds
+
+    def __init__(self, client, queue_size, overflow, qos_per_topic, max_inflight=100):
+        super().__init__()
+
+        if not overflow in publish_queue.overflow_policies:
+            raise ValueError(f'publish_queue: overflow policy must be one of {", ".join(publish_queue.overflow_policies)}')
+
+        self.client        = client
+        self.queue_size    = queue_size
+        self.overflow      = overflow
+        self.max_inflight  = max_inflight
+
+        # topic prefix -> QoS, longest prefix wins
+        self.qos_per_topic = sorted(qos_per_topic.items(), key=lambda x: len(x[0]), reverse=True)
+
+        self.queue         = collections.deque()
+        self.cond          = threading.Condition()
+
+        self.inflight      = collections.deque()  # MQTTMessageInfo of messages paho did not send yet
+        self.connected     = False
+
+        self.n_queued      = 0
+        self.n_published   = 0
+        self.n_dropped     = 0
+        self.n_failed      = 0
+
+        self.client.max_queued_messages_set(max_inflight)  # for QoS > 0
+
+        self.name = 'GHBot MQTT publish'
+        self.start()
+
+    def get_qos(self, topic):
+        for prefix, qos in self.qos_per_topic:
+            if topic.startswith(prefix):
+                return qos
+
+        return 0
+
+    def set_connected(self, connected):
+        with self.cond:
+            self.connected = connected
+
+            self.cond.notify_all()
+
+    # block=False: never wait, not even with the 'block' policy; the message
+    # is dropped (and counted) when the queue is full
+    def put(self, topic, content, retain, block=True):
+        with self.cond:
+            if len(self.queue) >= self.queue_size:
+                if self.overflow == 'block' and not block:
+                    self.n_dropped += 1
+
+                    return
+
+                if self.overflow == 'block':
+                    while len(self.queue) >= self.queue_size:
+                        self.cond.wait()
+
+                else:
+                    self.queue.popleft()
+
+                    self.n_dropped += 1
+
+            self.queue.append((topic, content, retain))
+
+            self.n_queued += 1
+
+            self.cond.notify_all()
+
+    def get_counters(self):
+        with self.cond:
+            return { 'queued': self.n_queued, 'published': self.n_published, 'dropped': self.n_dropped, 'failed': self.n_failed, 'pending': len(self.queue), 'inflight': len(self.inflight), 'connected': self.connected }
+
+    # invoked with cond held
+    def _can_send(self):
+        while len(self.inflight) > 0 and self.inflight[0].is_published():
+            self.inflight.popleft()
+
+        return self.connected and len(self.queue) > 0 and len(self.inflight) < self.max_inflight
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self._can_send():
+                    # paho does not notify when it has sent something; re-check periodically
+                    self.cond.wait(publish_queue.retry_interval if len(self.queue) > 0 else None)
+
+                topic, content, retain = self.queue.popleft()
+
+                self.cond.notify_all()  # for the 'block' policy
+
+            try:
+                print(f'mqtt_handler::topic: publish "{content}" to "{topic}"')
+
+                info = self.client.publish(topic, content, qos=self.get_qos(topic), retain=retain)
+
+                with self.cond:
+                    if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                        self.n_published += 1
+
+                        self.inflight.append(info)
+
+                    elif info.rc == mqtt.MQTT_ERR_NO_CONN or info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+                        # try again later; put it back in front unless that would exceed the queue size
+                        if len(self.queue) < self.queue_size or self.overflow == 'block':
+                            self.queue.appendleft((topic, content, retain))
+
+                        else:
+                            self.n_dropped += 1
+
+                        if info.rc == mqtt.MQTT_ERR_NO_CONN:
+                            self.connected = False
+
+                        self.cond.wait(publish_queue.retry_interval)
+
+                    else:
+                        self.n_failed += 1
+
+                        print(f'publish_queue::run: failed to publish to "{topic}": {mqtt.error_string(info.rc)}')
+
+            except Exception as e:
+                with self.cond:
+                    self.n_failed += 1
+
+                print(f'publish_queue::run: failed to publish to "{topic}": {e}')
+
 class mqtt_handler(threading.Thread):
-    def __init__(self, broker_ip, topic_prefix):
+    def __init__(self, broker_ip, topic_prefix, n_workers=4, queue_size=1000, overflow='drop-oldest', publish_queue_size=10000, publish_overflow='drop-oldest', publish_qos=dict()):
         super().__init__()
 
+        self.pool   = dispatch_pool(n_workers, queue_size, overflow)
+
         self.client = mqtt.Client()
 
+        # QoS is relative to the prefix-less topic
+        self.publisher = publish_queue(self.client, publish_queue_size, publish_overflow, { topic_prefix + t: qos for t, qos in publish_qos.items() })
+
         self.topic_prefix = topic_prefix
 
         self.topics = []
 
-        self.client.on_connect = self.on_connect
-        self.client.on_message = self.on_message
+        self.trie   = topic_trie()
+
+        self.client.on_connect    = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message    = self.on_message
 
         while True:
             try:
@@ -40,16 +353,20 @@ class mqtt_handler(threading.Thread):
 
         self.topics.append((self.topic_prefix + topic, msg_recv_cb))
 
+        self.trie.add(self.topic_prefix + topic, msg_recv_cb)
+
         self.client.subscribe(self.topic_prefix + topic)
 
     def publish(self, topic, content, **attributes):
-        print(f'mqtt_handler::topic: publish "{content}" to "{self.topic_prefix}{topic}"')
-
         persistent = False
         if 'persistent' in attributes:
             persistent = attributes['persistent']
 
-        self.client.publish(self.topic_prefix + topic, content, retain=persistent)
+        block = True
+        if 'block' in attributes:
+            block = attributes['block']
+
+        self.publisher.put(self.topic_prefix + topic, content, persistent, block)
 
     def on_connect(self, client, userdata, flags, rc):
         for topic in self.topics:
@@ -57,16 +374,20 @@ class mqtt_handler(threading.Thread):
 
             self.client.subscribe(topic[0])
 
+        self.publisher.set_connected(rc == 0)
+
+    def on_disconnect(self, client, userdata, rc):
+        self.publisher.set_connected(False)
+
     def on_message(self, client, userdata, msg):
         # print(f'mqtt_handler::topic: received "{msg.payload}" in topic "{msg.topic}"')
 
-        for topic in self.topics:
-            cleaned = topic[0].replace('#','')
+        match = self.trie.best_match(msg.topic)
 
-            if cleaned in msg.topic:
-                topic[1](msg.topic, msg.payload.decode('utf-8'))
+        if match != None:
+            self.pool.submit(msg.topic, match[1], match[2], msg.payload)
 
-                return
+            return
 
         print(f'mqtt_handler::topic: no handler for topic "{msg.topic}"')
 
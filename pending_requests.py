@@ -0,0 +1,210 @@
+#! /usr/bin/python3
+
+import collections
+import heapq
+import threading
+import time
+import uuid
+
+
+# keeps track of commands that were published to plugins and measures how
+# long the plugins take to reply
+#
+# plugins that registered with correlation enabled receive the command as
+# { "corr": id, "text": ... } and reply on to/irc/<channel>/privmsg/<id> (or
+# notice). for those the latency is exact and the user is told when the
+# plugin is slow ("still working") or does not reply at all.
+# for the other plugins the first reply in the channel is attributed to the
+# oldest command that is waiting there (weak: it may as well be a reply to
+# something else) and nobody is notified.
+class pending_requests(threading.Thread):
+    buckets = (0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)  # upper bounds in seconds; the last bucket is everything above
+
+    def __init__(self, bot, slow_after, timeout):
+        super().__init__()
+
+        self.bot        = bot  # for send_notice
+        self.slow_after = slow_after
+        self.timeout    = timeout
+
+        self.lock       = threading.Lock()
+        self.cond       = threading.Condition(self.lock)
+
+        self.options    = dict()  # command -> deadline (seconds) for commands with correlation enabled
+        self.pending    = dict()  # id -> [command, reply_to, start, deadline]
+        self.heap       = []      # (when, id, stage)
+        self.weak       = dict()  # channel -> deque of (start, command)
+
+        self.histograms = dict()  # command -> { 'exact': [...], 'weak': [...], 'exact_time': ..., 'weak_time': ..., 'slow': ..., 'timeouts': ... }
+
+        self.listeners  = []      # callables(command, outcome, took, corr) with outcome 'ok' or 'timeout'; exact only
+
+        self.name = 'GHBot pending requests'
+        self.start()
+
+    # deadline None: use the default timeout
+    def set_options(self, command, enabled, deadline=None):
+        with self.lock:
+            if enabled:
+                self.options[command] = deadline if deadline != None else self.timeout
+
+            else:
+                self.options.pop(command, None)
+
+    def is_correlated(self, command):
+        return command in self.options
+
+    # invoked with lock held
+    def _histogram(self, command):
+        h = self.histograms.get(command)
+
+        if h == None:
+            h = { 'exact': [0] * (len(pending_requests.buckets) + 1), 'weak': [0] * (len(pending_requests.buckets) + 1), 'exact_time': 0., 'weak_time': 0., 'slow': 0, 'timeouts': 0 }
+
+            self.histograms[command] = h
+
+        return h
+
+    # invoked with lock held
+    def _record(self, command, kind, took):
+        h = self._histogram(command)
+
+        i = 0
+
+        while i < len(pending_requests.buckets) and took > pending_requests.buckets[i]:
+            i += 1
+
+        h[kind][i]        += 1
+        h[kind + '_time'] += took
+
+    # channel: without '#', None for a private message; reply_to: where
+    # notices about the request go. returns the id to send along or None
+    def dispatch(self, command, channel, reply_to):
+        now = time.time()
+
+        with self.lock:
+            deadline = self.options.get(command)
+
+            if deadline == None:
+                if channel != None:
+                    self.weak.setdefault(channel, collections.deque()).append((now, command))
+
+                return None
+
+            corr = uuid.uuid4().hex[0:16]
+
+            self.pending[corr] = [command, reply_to, now, now + deadline]
+
+            if self.slow_after < deadline:
+                heapq.heappush(self.heap, (now + self.slow_after, corr, 'slow'))
+
+            heapq.heappush(self.heap, (now + deadline, corr, 'timeout'))
+
+            self.cond.notify()
+
+            return corr
+
+    # a plugin replied; corr is None when the reply has no id
+    def reply(self, channel, corr):
+        now = time.time()
+
+        with self.lock:
+            if corr != None:
+                entry = self.pending.pop(corr, None)
+
+                if entry == None:  # 2nd line of a reply, or too late
+                    return
+
+                self._record(entry[0], 'exact', now - entry[2])
+
+                listeners = list(self.listeners)
+
+            else:
+                queue = self.weak.get(channel)
+
+                while queue != None and len(queue) > 0:
+                    start, command = queue.popleft()
+
+                    if now - start <= self.timeout:
+                        self._record(command, 'weak', now - start)
+
+                        break
+
+                return
+
+        for listener in listeners:
+            listener(entry[0], 'ok', now - entry[2], corr)
+
+    def get_stats(self):
+        with self.lock:
+            out = dict()
+
+            for command, h in self.histograms.items():
+                n_exact = sum(h['exact'])
+                n_weak  = sum(h['weak'])
+
+                out[command] = {
+                        'buckets': [str(b) for b in pending_requests.buckets] + ['inf'],
+                        'exact': h['exact'],
+                        'exact_avg': h['exact_time'] / n_exact if n_exact > 0 else None,
+                        'weak': h['weak'],
+                        'weak_avg': h['weak_time'] / n_weak if n_weak > 0 else None,
+                        'slow': h['slow'],
+                        'timeouts': h['timeouts'],
+                        'correlated': command in self.options
+                        }
+
+            return { 'pending': len(self.pending), 'commands': out }
+
+    def run(self):
+        while True:
+            try:
+                notices  = []
+                timeouts = []
+
+                with self.cond:
+                    now = time.time()
+
+                    while len(self.heap) > 0 and self.heap[0][0] <= now:
+                        when, corr, stage = heapq.heappop(self.heap)
+
+                        entry = self.pending.get(corr)
+
+                        if entry == None:  # replied in the mean time
+                            continue
+
+                        if stage == 'slow':
+                            self._histogram(entry[0])['slow'] += 1
+
+                            notices.append((entry[1], f'{entry[0]}: still working...'))
+
+                        else:
+                            del self.pending[corr]
+
+                            self._histogram(entry[0])['timeouts'] += 1
+
+                            notices.append((entry[1], f'{entry[0]}: no reply within {entry[3] - entry[2]:.0f} seconds'))
+
+                            timeouts.append((entry[0], now - entry[2], corr))
+
+                    # forget weak entries that nothing replied to
+                    for channel, queue in self.weak.items():
+                        while len(queue) > 0 and now - queue[0][0] > self.timeout:
+                            queue.popleft()
+
+                    listeners = list(self.listeners)
+
+                    if len(notices) == 0:
+                        self.cond.wait(self.heap[0][0] - now if len(self.heap) > 0 else self.timeout)
+
+                for reply_to, text in notices:
+                    self.bot.send_notice(reply_to, text)
+
+                for command, took, corr in timeouts:
+                    for listener in listeners:
+                        listener(command, 'timeout', took, corr)
+
+            except Exception as e:
+                print(f'pending_requests::run: exception {e}')
+
+                time.sleep(1)
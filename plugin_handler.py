@@ -1,43 +1,371 @@
 #! /usr/bin/python3
 
-import importlib
+import ast
+import concurrent.futures
+import importlib.util
 import os
 import sys
+import threading
+import time
+from plugin_host import plugin_host_client
+from plugin_watcher import plugin_watcher
 
+# plugins are invoked in a thread pool so that a plugin that hangs (e.g. on
+# network i/o) does not hold the thread that processes IRC input. a plugin
+# module can set:
+# - MAX_CONCURRENCY: how many invocations of it may run at the same time
+# - TIMEOUTS: { command: seconds } to override the default timeout
+# - RUN_IN_PROCESS = True: CPU-heavy plugins; then compute(parameters) is
+#   invoked in a separate process and must return the text to send (or None)
+#
+# with host_mode 'subprocess' each plugin runs in a process of its own (see
+# plugin_host.py): a crashing or leaking plugin then does not take the bot
+# down; it is restarted instead.
+#
+# a plugin whose get_commandos() returns a literal is not imported until one
+# of its commands is invoked: the commands are read from the source. the
+# plugin directory can be watched (watch = inotify or poll) so that new and
+# changed plugins are (re)loaded without loadlp/reloadlp.
 class plugins_class:
-    def __init__(self, ghbot_instance, directory, name_prefix):
+    def __init__(self, ghbot_instance, directory, name_prefix, workers=8, concurrency=2, timeout=10., process_workers=2, host_mode='inprocess', rss_limit_mb=0, watch='off', poll_interval=5.):
         print(self, ghbot_instance)
         self.ghbot       = ghbot_instance
         self.directory   = directory
         self.name_prefix = name_prefix
 
-        self.plugins     = dict()
+        self.plugins     = dict()  # name -> module, plugin_host_client or None when not imported yet
+        self.manifests   = dict()  # name -> commandos as read from the source of a plugin that is not imported yet
+        self.mtimes      = dict()  # name -> modification time of the file when it was loaded
+        self.load_lock   = threading.Lock()
+
+        self.commands    = dict()  # command -> name of the plugin that handles it
+
+        self.executor         = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='GHBot local plugin')
+        self.process_executor = concurrent.futures.ProcessPoolExecutor(max_workers=process_workers) if process_workers > 0 else None
+
+        self.concurrency = concurrency
+        self.timeout     = timeout
+
+        self.host_mode    = host_mode
+        self.rss_limit_mb = rss_limit_mb
+
+        self.watch         = watch
+        self.poll_interval = poll_interval
+        self.watcher       = None
+
+        self.semaphores  = dict()  # plugin name -> BoundedSemaphore
+        self.stats       = dict()  # plugin name -> dict of counters
+        self.stats_lock  = threading.Lock()
 
         self.load_modules()
 
-    def load_modules(self):
-        which = []
+    # returns the commandos of a plugin without importing it, or None when
+    # get_commandos() does not simply return a literal
+    @staticmethod
+    def read_manifest(filename):
+        with open(filename, 'r') as fh:
+            tree = ast.parse(fh.read(), filename)
+
+        for node in tree.body:
+            if isinstance(node, ast.FunctionDef) and node.name == 'get_commandos':
+                if len(node.body) == 1 and isinstance(node.body[0], ast.Return) and node.body[0].value != None:
+                    try:
+                        return ast.literal_eval(node.body[0].value)
+
+                    except ValueError:
+                        pass
+
+                return None
+
+        return None
+
+    # name -> path of each plugin file
+    def _plugin_files(self):
+        out = dict()
 
         for filename in os.listdir(self.directory):
-            name_only = filename.rstrip('.py')
+            if filename.startswith(self.name_prefix) and filename.endswith('.py'):
+                out[filename[:-3]] = os.path.join(self.directory, filename)
+
+        return out
+
+    # executes the module in a new module object; when that fails, the
+    # previous version stays in use
+    def _import(self, name, path):
+        full_name = f'{self.directory}.{name}'
+
+        spec      = importlib.util.spec_from_file_location(full_name, path)
+        module    = importlib.util.module_from_spec(spec)
+
+        previous  = sys.modules.get(full_name)
+
+        sys.modules[full_name] = module
+
+        try:
+            spec.loader.exec_module(module)
+
+        except Exception as e:
+            if previous == None:
+                del sys.modules[full_name]
+
+            else:
+                sys.modules[full_name] = previous
+
+            raise e
+
+        return module
+
+    # returns False when the plugin could not be (re)loaded; then nothing
+    # changed. invoked with load_lock held
+    def _load(self, name, path):
+        try:
+            mtime = os.path.getmtime(path)
+
+            if self.host_mode == 'subprocess':
+                if isinstance(self.plugins.get(name), plugin_host_client):
+                    self.plugins[name].restart()
+
+                else:
+                    self.plugins[name] = plugin_host_client(self.directory, name, self.rss_limit_mb)
+
+            elif self.plugins.get(name) != None:
+                # in use already: replace it right away
+                self.plugins[name] = self._import(name, path)
 
-            if filename[0:len(self.name_prefix)] == self.name_prefix and not name_only in self.plugins:
-                full_name = f'{self.directory}.{name_only}'
-                self.plugins[name_only] = importlib.import_module(full_name)
+            else:
+                manifest = self.read_manifest(path)
 
-                which.append(name_only)
+                if manifest == None:
+                    self.plugins[name] = self._import(name, path)
+
+                else:
+                    self.manifests[name] = manifest
+                    self.plugins[name]   = None
+
+            if self.plugins[name] != None:
+                self.manifests.pop(name, None)
+
+            self.mtimes[name] = mtime
+
+            return True
+
+        except Exception as e:
+            print(f'while loading local plugin {name}: "{e}" at line number: {e.__traceback__.tb_lineno}')
+
+        return False
+
+    # invoked with load_lock held
+    def _unload(self, name):
+        module = self.plugins.pop(name, None)
+
+        if isinstance(module, plugin_host_client):
+            with module.lock:
+                module._stop()
+
+        self.manifests.pop(name, None)
+        self.mtimes.pop(name, None)
+        self.semaphores.pop(name, None)
+
+        sys.modules.pop(f'{self.directory}.{name}', None)
+
+    # imports a plugin on its first use
+    def _get_module(self, name):
+        module = self.plugins.get(name)
+
+        if module != None:
+            return module
+
+        with self.load_lock:
+            module = self.plugins.get(name)
+
+            if module == None:
+                module = self._import(name, os.path.join(self.directory, f'{name}.py'))
+
+                self.plugins[name] = module
+
+                self.manifests.pop(name, None)
+
+        return module
+
+    # loads plugins that are not known yet, returns their names
+    def load_modules(self):
+        which = []
+
+        with self.load_lock:
+            for name, path in sorted(self._plugin_files().items()):
+                if not name in self.plugins and self._load(name, path):
+                    which.append(name)
+
+            self._build_index()
 
         return which
 
-    # returns True if any plugin processed the command
-    def process(self, nick, parameters):
+    # (re)loads new and changed plugins and forgets the ones that were
+    # removed; invoked by the watcher
+    def rescan(self):
+        changed = []
+        removed = []
+
+        with self.load_lock:
+            files = self._plugin_files()
+
+            for name, path in sorted(files.items()):
+                try:
+                    mtime = os.path.getmtime(path)
+
+                except OSError:
+                    continue
+
+                if self.mtimes.get(name) != mtime and self._load(name, path):
+                    changed.append(name)
+
+            for name in list(self.plugins):
+                if not name in files:
+                    self._unload(name)
+
+                    removed.append(name)
+
+            if len(changed) == 0 and len(removed) == 0:
+                return
+
+            self._build_index()
+
+        print(f'plugins_class::rescan: (re)loaded: {", ".join(changed)}, removed: {", ".join(removed)}')
+
+        if self.ghbot != None:
+            self.ghbot.local_plugins_changed()
+
+    def start_watcher(self):
+        if self.watch != 'off' and self.watcher == None:
+            self.watcher = plugin_watcher(self.directory, self.rescan, self.watch, self.poll_interval)
+
+    def _build_index(self):
+        commands = dict()
+
         for name in self.plugins:
             try:
-                if self.plugins[name].process(self.ghbot, nick, parameters):
-                    return True
+                for command, parameters in self.get_commandos(name):
+                    commands[command] = name
 
             except Exception as e:
-                print(f'while invoking local plugin {name}: "{e}" at line number: {e.__traceback__.tb_lineno}')
+                print(f'while indexing local plugin {name}: "{e}" at line number: {e.__traceback__.tb_lineno}')
+
+        self.commands = commands
+
+    def _account(self, name, took, outcome):
+        with self.stats_lock:
+            stats = self.stats.get(name)
+
+            if stats == None:
+                stats = { 'calls': 0, 'errors': 0, 'timeouts': 0, 'busy': 0, 'total_time': 0., 'max_time': 0. }
+
+                self.stats[name] = stats
+
+            if outcome == 'busy':
+                stats['busy'] += 1
+
+                return
+
+            stats['calls']      += 1
+            stats['total_time'] += took
+            stats['max_time']    = max(stats['max_time'], took)
+
+            if outcome == 'error':
+                stats['errors'] += 1
+
+            elif outcome == 'timeout':
+                stats['timeouts'] += 1
+
+    def get_stats(self):
+        with self.stats_lock:
+            out = { name: dict(stats) for name, stats in self.stats.items() }
+
+        for name, module in list(self.plugins.items()):
+            if isinstance(module, plugin_host_client):
+                stats = out.setdefault(name, dict())
+                stats['restarts'] = module.restarts
+                stats['rss_mb']   = module.get_rss_mb()
+
+        return out
+
+    def _invoke(self, name, module, nick, parameters, semaphore):
+        try:
+            if getattr(module, 'RUN_IN_PROCESS', False) and self.process_executor != None:
+                text = self.process_executor.submit(module.compute, parameters).result()
+
+                if text == None:
+                    return False
+
+                self.ghbot.send_ok(parameters[3], text)
+
+                return True
+
+            return module.process(self.ghbot, nick, parameters)
+
+        finally:
+            semaphore.release()
+
+    # returns True if the plugin that owns the command processed it
+    # parameters: (prefix, command, splitted_args, channel)
+    def process(self, nick, parameters):
+        name = self.commands.get(parameters[1])
+
+        if name == None:
+            return False
+
+        try:
+            module = self._get_module(name)
+
+        except Exception as e:
+            print(f'while importing local plugin {name}: "{e}" at line number: {e.__traceback__.tb_lineno}')
+
+            return False
+
+        semaphore = self.semaphores.get(name)
+
+        if semaphore == None:
+            semaphore = self.semaphores.setdefault(name, threading.BoundedSemaphore(getattr(module, 'MAX_CONCURRENCY', self.concurrency)))
+
+        if not semaphore.acquire(blocking=False):
+            self._account(name, 0., 'busy')
+
+            self.ghbot.send_error(parameters[3], f'{parameters[1]}: too busy, try again later')
+
+            return True
+
+        timeout = getattr(module, 'TIMEOUTS', dict()).get(parameters[1], self.timeout)
+
+        start   = time.time()
+
+        try:
+            future = self.executor.submit(self._invoke, name, module, nick, parameters, semaphore)
+
+        except Exception as e:
+            semaphore.release()
+
+            print(f'while invoking local plugin {name}: "{e}" at line number: {e.__traceback__.tb_lineno}')
+
+            return False
+
+        try:
+            rc = future.result(timeout=timeout)
+
+            self._account(name, time.time() - start, 'ok')
+
+            return rc
+
+        except concurrent.futures.TimeoutError:
+            # the invocation keeps running (and keeps its concurrency slot) until the plugin returns
+            self._account(name, time.time() - start, 'timeout')
+
+            self.ghbot.send_error(parameters[3], f'{parameters[1]}: no response within {timeout} seconds')
+
+            return True
+
+        except Exception as e:
+            self._account(name, time.time() - start, 'error')
+
+            print(f'while invoking local plugin {name}: "{e}" at line number: {e.__traceback__.tb_lineno}')
 
         return False
 
@@ -45,20 +373,26 @@ class plugins_class:
         return [name for name in self.plugins]
 
     def get_commandos(self, name):
-        return self.plugins[name].get_commandos()
+        module = self.plugins[name]
+
+        if module == None:
+            return self.manifests[name]
+
+        return module.get_commandos()
 
     def reload_module(self, name):
-        ok = False
+        path = self._plugin_files().get(name)
 
-        full_name = f'{self.directory}.{name}'
+        if path == None:
+            return False
 
-        for k, v in list(sys.modules.items()):
-            if full_name in k:
-                importlib.reload(v)
+        with self.load_lock:
+            if not self._load(name, path):
+                return False
 
-                ok = True
+            self._build_index()
 
-        return ok
+        return True
 
 if __name__ == "__main__":
     plugin_subdir = 'plugins'  # relative path!!
@@ -66,7 +400,7 @@ if __name__ == "__main__":
 
     print(plugins.list_plugins())
 
-    plugins.process('test', '!door_open')
+    plugins.process('test', ('test', 'open_door', ['open_door'], '#test'))
 
     print(plugins.get_commandos('ghb_door'))
 
@@ -0,0 +1,222 @@
+#! /usr/bin/python3
+
+# runs a local plugin in a separate process. the bot talks to it over the
+# stdin/stdout pipes of that process; every message is a frame: a 4 byte
+# (big endian) length followed by that many bytes of JSON.
+#
+# bot -> host:  { "op": "meta" }
+#               { "op": "process", "nick": ..., "parameters": [...] }
+# host -> bot:  { "op": "call", "method": "send_ok", "args": [...] }  (zero or more, while processing)
+#               { "op": "result", "value": ... } or { "op": "error", "error": ... }
+
+import importlib
+import json
+import os
+import struct
+import subprocess
+import sys
+import threading
+
+
+def write_frame(fh, msg):
+    data = json.dumps(msg).encode('utf-8')
+
+    fh.write(struct.pack('>I', len(data)) + data)
+    fh.flush()
+
+def read_frame(fh):
+    header = fh.read(4)
+
+    if len(header) < 4:
+        return None
+
+    length = struct.unpack('>I', header)[0]
+
+    data = fh.read(length)
+
+    if len(data) < length:
+        return None
+
+    return json.loads(data.decode('utf-8'))
+
+# bot side of a plugin; has the same interface as a plugin module
+class plugin_host_client:
+    # methods of the bot that a plugin can invoke
+    allowed_methods = ('send_ok', 'send_error', 'send_notice', 'send_error_notice', 'send_more')
+
+    def __init__(self, directory, name, rss_limit_mb, kill_after=60.):
+        self.directory       = directory
+        self.name            = name
+        self.rss_limit_mb    = rss_limit_mb  # 0: no limit
+        self.kill_after      = kill_after    # a call that takes longer is considered a hang
+
+        self.lock            = threading.Lock()
+        self.proc            = None
+        self.restarts        = 0
+
+        self.MAX_CONCURRENCY = 1  # requests are handled one by one
+        self.TIMEOUTS        = dict()
+        self.commandos       = []
+
+        with self.lock:
+            self._start()
+
+    # invoked with lock held
+    def _start(self):
+        if self.proc != None:
+            self._stop()
+
+        self.proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), self.directory, self.name], stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=os.getcwd())
+
+        meta = self._request({ 'op': 'meta' }, None)
+
+        self.commandos = [(command, parameters) for command, parameters in meta['commandos']]
+        self.TIMEOUTS  = meta['timeouts']
+
+        print(f'plugin_host_client: {self.name} started (pid {self.proc.pid})')
+
+    # invoked with lock held
+    def _stop(self):
+        try:
+            self.proc.kill()
+            self.proc.wait()
+
+        except Exception as e:
+            print(f'plugin_host_client: cannot stop {self.name}: {e}')
+
+        self.proc = None
+
+    # invoked with lock held
+    def _request(self, msg, ghbot_instance):
+        proc = self.proc
+
+        watchdog = threading.Timer(self.kill_after, proc.kill)
+        watchdog.start()
+
+        try:
+            write_frame(proc.stdin, msg)
+
+            while True:
+                reply = read_frame(proc.stdout)
+
+                if reply == None:
+                    raise EOFError(f'plugin host for {self.name} went away')
+
+                if reply['op'] == 'call':
+                    if reply['method'] in plugin_host_client.allowed_methods and ghbot_instance != None:
+                        getattr(ghbot_instance, reply['method'])(*reply['args'])
+
+                elif reply['op'] == 'result':
+                    return reply['value']
+
+                elif reply['op'] == 'error':
+                    raise Exception(reply['error'])
+
+        finally:
+            watchdog.cancel()
+
+    def get_rss_mb(self):
+        try:
+            with open(f'/proc/{self.proc.pid}/status', 'r') as fh:
+                for line in fh:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024.
+
+        except Exception as e:
+            pass
+
+        return None
+
+    def restart(self):
+        with self.lock:
+            self._start()
+
+            self.restarts += 1
+
+    def get_commandos(self):
+        return self.commandos
+
+    def process(self, ghbot_instance, nick, parameters):
+        with self.lock:
+            if self.proc == None or self.proc.poll() != None:
+                print(f'plugin_host_client: {self.name} is not running, restarting')
+
+                self._start()
+
+                self.restarts += 1
+
+            try:
+                return self._request({ 'op': 'process', 'nick': nick, 'parameters': list(parameters) }, ghbot_instance)
+
+            except EOFError as e:
+                print(f'plugin_host_client: {self.name} crashed, restarting')
+
+                self._start()
+
+                self.restarts += 1
+
+                raise e
+
+            finally:
+                rss = self.get_rss_mb()
+
+                if self.rss_limit_mb > 0 and rss != None and rss > self.rss_limit_mb:
+                    print(f'plugin_host_client: {self.name} uses {rss:.1f} MB (limit: {self.rss_limit_mb} MB), restarting')
+
+                    self._start()
+
+                    self.restarts += 1
+
+# plugin side: forwards the calls of a plugin to the bot
+class bot_proxy:
+    def __init__(self, out):
+        self.out = out
+
+    def __getattr__(self, method):
+        if not method in plugin_host_client.allowed_methods:
+            raise AttributeError(f'{method} is not available for plugins in a plugin host')
+
+        def call(*args):
+            write_frame(self.out, { 'op': 'call', 'method': method, 'args': list(args) })
+
+        return call
+
+def host_main(directory, name):
+    # frames go over the original stdout, whatever the plugin prints goes to stderr
+    out = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    sys.path.insert(0, os.getcwd())
+
+    module = importlib.import_module(f'{directory}.{name}')
+
+    proxy  = bot_proxy(out)
+
+    while True:
+        msg = read_frame(sys.stdin.buffer)
+
+        if msg == None:
+            break
+
+        try:
+            if msg['op'] == 'meta':
+                meta = dict()
+                meta['commandos'] = module.get_commandos()
+                meta['timeouts']  = getattr(module, 'TIMEOUTS', dict())
+
+                write_frame(out, { 'op': 'result', 'value': meta })
+
+            elif msg['op'] == 'process':
+                rc = module.process(proxy, msg['nick'], tuple(msg['parameters']))
+
+                write_frame(out, { 'op': 'result', 'value': rc })
+
+            else:
+                write_frame(out, { 'op': 'error', 'error': f'unknown op {msg["op"]}' })
+
+        except Exception as e:
+            write_frame(out, { 'op': 'error', 'error': f'{e} at line number: {e.__traceback__.tb_lineno}' })
+
+if __name__ == "__main__":
+    host_main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,110 @@
+#! /usr/bin/python3
+
+import json
+import os
+import threading
+import types
+
+
+class plugin_record:
+    __slots__ = ('descr', 'acl_group', 'author', 'location', 'provisional')
+
+    # provisional: loaded from disk at startup, not confirmed by the plugin yet
+    def __init__(self, descr, acl_group, author, location, provisional=False):
+        self.descr       = descr
+        self.acl_group   = acl_group
+        self.author      = author
+        self.location    = location
+        self.provisional = provisional
+
+    # from the [descr, acl_group, timestamp, author, location] lists as
+    # returned by get_commandos() of local plugins
+    @staticmethod
+    def from_list(l):
+        return plugin_record(l[0], l[1], l[3], l[4])
+
+    def __eq__(self, other):
+        return isinstance(other, plugin_record) and (self.descr, self.acl_group, self.author, self.location, self.provisional) == (other.descr, other.acl_group, other.author, other.location, other.provisional)
+
+class registry_snapshot:
+    __slots__ = ('version', 'plugins')
+
+    def __init__(self, version, plugins):
+        self.version = version
+        self.plugins = types.MappingProxyType(plugins)  # cmd -> plugin_record, read-only
+
+# the set of known commands. readers pick up the current snapshot (one
+# attribute read, no locking) and can use it for as long as they like;
+# writers build a new snapshot and swap it in. the version increases with
+# every change and can be used to invalidate caches.
+#
+# keepalives change all the time and are therefore not part of a snapshot.
+class plugin_registry:
+    def __init__(self):
+        self.lock       = threading.Lock()  # serializes writers
+
+        self.snapshot   = registry_snapshot(0, dict())
+
+        self.keepalives = dict()  # cmd -> time of latest registration
+
+    def current(self):
+        return self.snapshot
+
+    def touch(self, cmd, ts):
+        self.keepalives[cmd] = ts
+
+    def latest_ka(self, cmd):
+        return self.keepalives.get(cmd)
+
+    # records: cmd -> plugin_record to add or replace, remove: commands to
+    # drop; returns the (possibly unchanged) current snapshot
+    def update(self, records=dict(), remove=()):
+        with self.lock:
+            current = self.snapshot
+
+            changed = [cmd for cmd, record in records.items() if current.plugins.get(cmd) != record]
+            removed = [cmd for cmd in remove if cmd in current.plugins]
+
+            if len(changed) == 0 and len(removed) == 0:
+                return current
+
+            plugins = dict(current.plugins)
+
+            for cmd in changed:
+                plugins[cmd] = records[cmd]
+
+            for cmd in removed:
+                del plugins[cmd]
+
+                self.keepalives.pop(cmd, None)
+
+            self.snapshot = registry_snapshot(current.version + 1, plugins)
+
+            return self.snapshot
+
+    # stores the current snapshot (minus the commands in exclude); returns
+    # the version that was written
+    def save(self, filename, exclude):
+        current = self.snapshot
+
+        out = dict()
+
+        for cmd, record in current.plugins.items():
+            if not cmd in exclude:
+                out[cmd] = { 'descr': record.descr, 'acl_group': record.acl_group, 'author': record.author, 'location': record.location }
+
+        # write + rename so that a crash never leaves a half written file
+        with open(filename + '.tmp', 'w') as fh:
+            fh.write(json.dumps(out))
+
+        os.replace(filename + '.tmp', filename)
+
+        return current.version
+
+    # returns cmd -> provisional plugin_record
+    @staticmethod
+    def load(filename):
+        with open(filename, 'r') as fh:
+            data = json.loads(fh.read())
+
+        return { cmd: plugin_record(r['descr'], r['acl_group'], r['author'], r['location'], True) for cmd, r in data.items() }
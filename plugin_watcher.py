@@ -0,0 +1,136 @@
+#! /usr/bin/python3
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+
+# invokes callback() when files in a directory are created, changed, moved
+# or removed. uses inotify when available, else it compares the modification
+# times of the files every poll_interval seconds. changes that arrive within
+# settle seconds of each other result in one callback (editors tend to write
+# a file in a couple of steps).
+class plugin_watcher(threading.Thread):
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+
+    def __init__(self, directory, callback, mode='inotify', poll_interval=5., settle=0.5):
+        super().__init__()
+
+        self.directory     = directory
+        self.callback      = callback
+        self.poll_interval = poll_interval
+        self.settle        = settle
+
+        self.fd            = None
+
+        if mode == 'inotify':
+            self.fd = self._inotify_init()
+
+            if self.fd == None:
+                print(f'plugin_watcher: inotify not available, polling {directory} every {poll_interval} seconds')
+
+        self.daemon = True
+        self.name = 'GHBot plugin watcher'
+        self.start()
+
+    def _inotify_init(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+            fd   = libc.inotify_init1(os.O_CLOEXEC)
+
+            if fd < 0:
+                return None
+
+            mask = plugin_watcher.IN_CLOSE_WRITE | plugin_watcher.IN_MOVED_FROM | plugin_watcher.IN_MOVED_TO | plugin_watcher.IN_CREATE | plugin_watcher.IN_DELETE
+
+            if libc.inotify_add_watch(fd, self.directory.encode('utf-8'), mask) < 0:
+                os.close(fd)
+
+                return None
+
+            return fd
+
+        except Exception as e:
+            print(f'plugin_watcher::_inotify_init: {e}')
+
+            return None
+
+    # returns True if a .py file was involved
+    def _read_events(self):
+        data = os.read(self.fd, 65536)
+
+        relevant = False
+
+        offset   = 0
+
+        while offset + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0').decode('utf-8', 'replace')
+
+            if name.endswith('.py'):
+                relevant = True
+
+            offset += 16 + length
+
+        return relevant
+
+    def _mtimes(self):
+        out = dict()
+
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.py'):
+                    out[entry.name] = entry.stat().st_mtime
+
+        except Exception as e:
+            print(f'plugin_watcher::_mtimes: {e}')
+
+        return out
+
+    def _run_inotify(self):
+        while True:
+            if not self._read_events():
+                continue
+
+            # wait until things settle down
+            while len(select.select([self.fd], [], [], self.settle)[0]) > 0:
+                self._read_events()
+
+            self.callback()
+
+    def _run_poll(self):
+        mtimes = self._mtimes()
+
+        while True:
+            time.sleep(self.poll_interval)
+
+            current = self._mtimes()
+
+            if current != mtimes:
+                mtimes = current
+
+                self.callback()
+
+    def run(self):
+        while True:
+            try:
+                if self.fd != None:
+                    self._run_inotify()
+
+                else:
+                    self._run_poll()
+
+            except Exception as e:
+                print(f'plugin_watcher::run: exception {e}')
+
+                time.sleep(self.poll_interval)
@@ -1,4 +1,6 @@
 import http.client
+import os
+import queue
 import socket
 import ssl
 import threading
@@ -13,9 +15,160 @@ SSL_CA_CERT = P + 'door/ca.crt'
 SSL_CERT    = P + 'door/ghbot.crt'
 SSL_KEY     = P + 'door/ghbot.key'
 
+DOOR_TIMEOUT = 10.  # seconds, for connecting and for the request
+POOL_SIZE    = 2    # idle connections to keep
+
+TIMEOUTS     = { 'open_door': 2 * DOOR_TIMEOUT + 5 }  # a retry on a stale pooled connection may take two
+
 door_ts   = None
 door_user = None
 
+# the SSL context is only rebuilt when one of the certificate files changes
+ssl_lock    = threading.Lock()
+ssl_context = None
+ssl_mtimes  = None
+ssl_session = None  # for TLS session resumption
+
+pool = queue.LifoQueue(POOL_SIZE)
+
+stats_lock = threading.Lock()
+stats = { 'requests': 0, 'errors': 0, 'total_time': 0., 'max_time': 0., 'handshakes': 0, 'resumed': 0, 'reused': 0 }
+
+class door_connection(http.client.HTTPSConnection):
+    def __init__(self, context, session):
+        super().__init__(HOST, PORT, context=context, timeout=DOOR_TIMEOUT)
+
+        self.session = session
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host, session=self.session)
+
+def get_context():
+    global ssl_context
+    global ssl_mtimes
+    global ssl_session
+
+    mtimes = tuple(os.stat(f).st_mtime for f in (SSL_CA_CERT, SSL_CERT, SSL_KEY))
+
+    with ssl_lock:
+        if ssl_context == None or mtimes != ssl_mtimes:
+            ct = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            ct.load_verify_locations(cafile=SSL_CA_CERT)
+            ct.load_cert_chain(certfile=SSL_CERT, keyfile=SSL_KEY)
+            ct.verify_mode = ssl.CERT_REQUIRED
+            ct.check_hostname = False
+
+            ssl_context = ct
+            ssl_mtimes  = mtimes
+            ssl_session = None
+
+            # connections of the previous context are no longer valid
+            while not pool.empty():
+                pool.get_nowait().close()
+
+        return ssl_context, ssl_session
+
+# fresh: do not take one from the pool
+def get_connection(fresh=False):
+    if not fresh:
+        try:
+            return pool.get_nowait(), True
+
+        except queue.Empty:
+            pass
+
+    ct, session = get_context()
+
+    conn = door_connection(ct, session)
+    conn.connect()
+
+    subj = conn.sock.getpeercert()['subject'][-1][0][-1]
+
+    if subj not in VALID_CERT_SUBJECTS:
+        conn.close()
+
+        raise ssl.SSLError(f'Incorrect client cert found: {subj}')
+
+    with stats_lock:
+        stats['handshakes'] += 1
+        stats['resumed']    += conn.sock.session_reused
+
+    return conn, False
+
+# will_close: the controller closes the connection after this response
+# (HTTP/1.0 or 'Connection: close')
+def put_connection(conn, will_close):
+    global ssl_session
+
+    # http.client drops the socket itself when the server closes it; such a
+    # connection would silently reconnect on the next request, without the
+    # certificate subject check in get_connection()
+    if conn.sock == None or will_close:
+        conn.close()
+
+        return
+
+    # with TLS 1.3 the session ticket only arrives after the handshake
+    with ssl_lock:
+        if conn._context == ssl_context:
+            ssl_session = conn.sock.session
+
+    try:
+        pool.put_nowait(conn)
+
+    except queue.Full:
+        conn.close()
+
+# returns the response of the door controller
+def door_request():
+    start = time.time()
+
+    try:
+        conn, reused = get_connection()
+
+        try:
+            conn.request('GET','/')
+
+            response = conn.getresponse()
+
+            result = response.read().decode()
+
+        except (http.client.HTTPException, ConnectionError) as e:
+            conn.close()
+
+            if not reused:
+                raise e
+
+            # the controller closed the idle connection, try once more with a
+            # new one (not another pooled one: that may be just as stale)
+            conn, reused = get_connection(True)
+
+            conn.request('GET','/')
+
+            response = conn.getresponse()
+
+            result = response.read().decode()
+
+        put_connection(conn, response.will_close)
+
+    except Exception as e:
+        with stats_lock:
+            stats['errors'] += 1
+
+        raise e
+
+    took = time.time() - start
+
+    with stats_lock:
+        stats['requests']   += 1
+        stats['reused']     += reused
+        stats['total_time'] += took
+        stats['max_time']    = max(stats['max_time'], took)
+
+    return result
+
 def init(*args, **kwargs):
     timeout_thread = threading.Thread(target=door_timeout)
     timeout_thread.start()
@@ -30,21 +183,13 @@ def process(ghbot_instance, nick, parameters):
     try:
         nick = nick.lower()
 
-        ct = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-        ct.load_verify_locations(cafile=SSL_CA_CERT)
-        ct.load_cert_chain(certfile=SSL_CERT, keyfile=SSL_KEY)
-        ct.verify_mode = ssl.CERT_REQUIRED
-        ct.check_hostname = False
+        if parameters[1] == 'door_stats':
+            with stats_lock:
+                avg = stats['total_time'] * 1000. / stats['requests'] if stats['requests'] > 0 else 0.
 
-        conn = http.client.HTTPSConnection(HOST, PORT, context=ct)
-        conn.connect()
+                ghbot_instance.send_ok(parameters[3], f'door: {stats["requests"]} requests ({stats["errors"]} errors), avg {avg:.1f} ms, max {stats["max_time"] * 1000.:.1f} ms, {stats["handshakes"]} handshakes ({stats["resumed"]} resumed), {stats["reused"]} pooled')
 
-        subj = conn.sock.getpeercert()['subject'][-1][0][-1]
-
-        if subj not in VALID_CERT_SUBJECTS:
-            ghbot_instance.send_ok(parameters[3], f'Incorrect client cert found: {conn.sock.getpeercert()})')
-            conn.sock.shutdown(socket.SHUT_RD)
-            return False
+            return True
 
         if parameters[1] == 'open_door':
             now_ts = time.time()
@@ -60,15 +205,13 @@ def process(ghbot_instance, nick, parameters):
                 door_user = nick
 
             elif door_ts != None and door_user != None and door_user != nick and age < 5.0:
-                conn.request('GET','/')
+                door_ts   = None
+                door_user = None
 
-                result = conn.getresponse().read().decode()
+                result = door_request()
 
                 ghbot_instance.send_ok(parameters[3], f'open_door result: {result}')
 
-                door_ts   = None
-                door_user = None
-
             elif door_ts != None and age >= 5.0:
                 ghbot_instance.send_ok(parameters[3], f'open_door timeout')
 
@@ -81,8 +224,6 @@ def process(ghbot_instance, nick, parameters):
                 door_ts   = None
                 door_user = None
 
-            conn.close()
-
             return True
 
     except Exception as e:
@@ -94,5 +235,6 @@ def get_commandos():
     return [
             ('open_door', ['Open the front door', 'doorcontrol', 0, 'Flok', 'local plugin']),
             ('lock_door', ['Lock the front door', 'doorcontrol', 0, 'Flok', 'local plugin']),
-            ('unlock_door', ['Unlock the front door', 'doorcontrol', 0, 'Flok', 'local plugin'])
+            ('unlock_door', ['Unlock the front door', 'doorcontrol', 0, 'Flok', 'local plugin']),
+            ('door_stats', ['Show latency statistics of the door controller', 'doorcontrol', 0, 'Flok', 'local plugin'])
             ]
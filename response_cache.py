@@ -0,0 +1,188 @@
+#! /usr/bin/python3
+
+import collections
+import threading
+import time
+
+
+# replies of plugin commands that registered as cacheable (with a ttl)
+#
+# after a cacheable command is published, its replies are collected for
+# window seconds.
+# plugins that use correlation ids reply with the id of the command, so only
+# those replies are collected.
+# for the other plugins the replies arrive without any reference to the
+# command they belong to: every privmsg/notice in that channel is collected.
+# if something else that can cause a reply happens in that channel during
+# the window (another command, a channel message), the replies are ambiguous
+# and not cached. output of plugins that is not caused by anything in the
+# channel (e.g. feed announcements) cannot be told apart though, so such a
+# message may end up in the cache; plugins that register cacheable commands
+# should use correlation ids.
+class response_cache:
+    entry_overhead = 200  # rough size of an entry besides the texts, in bytes
+
+    def __init__(self, max_bytes, window):
+        self.max_bytes = max_bytes
+        self.window    = window
+
+        self.lock      = threading.Lock()
+
+        self.ttls      = dict()  # command -> seconds
+        self.entries   = collections.OrderedDict()  # key -> (expires, size, [(kind, text), ...]); least recently used first
+        self.n_bytes   = 0
+
+        self.captures  = dict()  # ('channel', channel) or ('corr', id) -> [key, deadline, replies, ambiguous]
+
+        self.counters  = { 'hits': 0, 'misses': 0, 'stored': 0, 'ambiguous': 0, 'no_reply': 0, 'expired': 0, 'evicted': 0 }
+
+    # ttl 0: not cacheable; previous replies are dropped when the ttl changes
+    def set_ttl(self, command, ttl):
+        ttl = max(0., ttl)
+
+        with self.lock:
+            if self.ttls.get(command, 0) == ttl:
+                return
+
+            if ttl > 0:
+                self.ttls[command] = ttl
+
+            else:
+                self.ttls.pop(command, None)
+
+            for key in [key for key in self.entries if key[0] == command]:
+                self._remove(key)
+
+    def is_cacheable(self, command):
+        return command in self.ttls
+
+    @staticmethod
+    def make_key(command, text, channel):
+        args = ' '.join(text.split()[1:]).lower()
+
+        return (command, args, channel.lower())
+
+    # invoked with lock held
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+
+        self.n_bytes -= entry[1]
+
+    # invoked with lock held
+    def _finish_captures(self, now):
+        for capture_key in [capture_key for capture_key, capture in self.captures.items() if capture[1] <= now]:
+            key, deadline, replies, ambiguous = self.captures.pop(capture_key)
+
+            if ambiguous:
+                self.counters['ambiguous'] += 1
+
+            elif len(replies) == 0:
+                self.counters['no_reply'] += 1
+
+            elif key[0] in self.ttls:
+                size = response_cache.entry_overhead + len(key[1]) + sum([len(text) for kind, text in replies])
+
+                if key in self.entries:
+                    self._remove(key)
+
+                self.entries[key] = (now + self.ttls[key[0]], size, replies)
+                self.n_bytes     += size
+
+                self.counters['stored'] += 1
+
+                while self.n_bytes > self.max_bytes and len(self.entries) > 0:
+                    self._remove(next(iter(self.entries)))
+
+                    self.counters['evicted'] += 1
+
+    # returns the [(kind, text), ...] to send or None
+    def lookup(self, key):
+        now = time.time()
+
+        with self.lock:
+            self._finish_captures(now)
+
+            entry = self.entries.get(key)
+
+            if entry != None and entry[0] <= now:
+                self._remove(key)
+
+                self.counters['expired'] += 1
+
+                entry = None
+
+            if entry == None:
+                self.counters['misses'] += 1
+
+                return None
+
+            self.entries.move_to_end(key)
+
+            self.counters['hits'] += 1
+
+            return entry[2]
+
+    # a cacheable command was published in channel; corr is its correlation
+    # id or None
+    def expect(self, key, channel, corr=None):
+        now = time.time()
+
+        with self.lock:
+            self._finish_captures(now)
+
+            if corr != None:
+                self.captures[('corr', corr)] = [key, now + self.window, [], False]
+
+                return
+
+            capture = self.captures.get(('channel', channel))
+
+            if capture != None:
+                capture[3] = True
+
+                # the new command is ambiguous too
+                capture[1] = max(capture[1], now + self.window)
+
+            else:
+                self.captures[('channel', channel)] = [key, now + self.window, [], False]
+
+    # something happened in channel that may trigger replies
+    def activity(self, channel):
+        now = time.time()
+
+        with self.lock:
+            # a capture whose window has passed is complete; store it first
+            self._finish_captures(now)
+
+            capture = self.captures.get(('channel', channel))
+
+            if capture != None and capture[1] > now:
+                capture[3] = True
+
+    # kind is 'privmsg' or 'notice'; corr is the correlation id the reply
+    # carries or None
+    def reply(self, channel, kind, text, corr=None):
+        now = time.time()
+
+        with self.lock:
+            if corr != None:
+                capture = self.captures.get(('corr', corr))
+
+            else:
+                capture = self.captures.get(('channel', channel))
+
+            if capture != None and capture[1] > now:
+                capture[2].append((kind, text))
+
+    def get_stats(self):
+        with self.lock:
+            self._finish_captures(time.time())
+
+            out = dict(self.counters)
+            out['entries']   = len(self.entries)
+            out['bytes']     = self.n_bytes
+            out['max_bytes'] = self.max_bytes
+            out['hit_rate']  = self.counters['hits'] / (self.counters['hits'] + self.counters['misses']) if self.counters['hits'] + self.counters['misses'] > 0 else None
+            out['ttls']      = dict(self.ttls)
+
+            return out
@@ -0,0 +1,47 @@
+#! /usr/bin/python3
+
+# maps MQTT topics (without prefix) to (route name, handler)
+#
+# - exact topics, e.g. to/irc/<channel>/privmsg
+# - exact topics that may carry the correlation id of a command as an extra
+#   level: to/irc/<channel>/privmsg/<id>
+# - shapes: topics with a variable part (a nick) that are matched on their
+#   first two levels, optionally with a correlation id at a fixed level, e.g.
+#   to/irc/\<nick>/<id>
+class route_table:
+    def __init__(self):
+        self.routes     = dict()  # topic -> (name, handler)
+        self.correlated = set()   # topics in routes that accept a correlation id
+        self.shapes     = dict()  # (level 0, level 1) -> (name, handler, level of the correlation id or None)
+
+    def add(self, topic, name, handler, correlated=False):
+        self.routes[topic] = (name, handler)
+
+        if correlated:
+            self.correlated.add(topic)
+
+    def add_shape(self, levels, name, handler, corr_level=None):
+        self.shapes[tuple(levels)] = (name, handler, corr_level)
+
+    # returns ((name, handler), correlation id or None) or (None, None)
+    def resolve(self, parts):
+        route = self.routes.get('/'.join(parts))
+
+        if route != None:
+            return (route, None)
+
+        if len(parts) >= 2:
+            base = '/'.join(parts[0:-1])
+
+            if base in self.correlated:
+                return (self.routes[base], parts[-1])
+
+        if len(parts) >= 3:
+            shape = self.shapes.get((parts[0], parts[1]))
+
+            if shape != None:
+                corr = parts[shape[2]] if shape[2] != None and len(parts) > shape[2] else None
+
+                return ((shape[0], shape[1]), corr)
+
+        return (None, None)
@@ -0,0 +1,51 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hostmask import hostmask_matcher
+
+
+class test_hostmask(unittest.TestCase):
+    def matcher(self, patterns):
+        m = hostmask_matcher()
+
+        m.compile(patterns)
+
+        return m
+
+    def test_brackets_are_literal(self):
+        m = self.matcher(['foo[m]!*@*'])
+
+        self.assertEqual(m.match('foo[m]!x@y'), ['foo[m]!*@*'])
+        self.assertEqual(m.match('foom!x@y'), [])
+
+    def test_backslash_is_literal(self):
+        m = self.matcher(['*!*\\bar@*', 'a\\*!*@*'])
+
+        self.assertEqual(m.match('nick!x\\bar@host'), ['*!*\\bar@*'])
+        self.assertEqual(m.match('a\\b!x@y'), ['a\\*!*@*'])
+        self.assertEqual(m.match('ab!x@y'), [])
+
+    def test_host_suffix(self):
+        m = self.matcher(['*!*@*.example'])
+
+        self.assertEqual(m.match('nick!user@host.example'), ['*!*@*.example'])
+        self.assertEqual(m.match('nick!user@host.example.org'), [])
+
+    def test_nick_prefix(self):
+        m = self.matcher(['nick?!*@*'])
+
+        self.assertEqual(m.match('Nick2!user@host'), ['nick?!*@*'])
+        self.assertEqual(m.match('nick!user@host'), [])
+
+    def test_best_match(self):
+        m = self.matcher(['*!*@*', 'flok!*@*.example'])
+
+        self.assertEqual(m.best_match('flok!x@host.example'), 'flok!*@*.example')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from route_table import route_table
+
+
+class test_route_table(unittest.TestCase):
+    def setUp(self):
+        self.routes = route_table()
+
+        self.routes.add('to/irc/test/privmsg', 'privmsg', 'privmsg-handler', correlated=True)
+        self.routes.add('to/irc/test/notice',  'notice',  'notice-handler',  correlated=True)
+        self.routes.add('to/irc/test/topic',   'topic',   'topic-handler')
+
+        self.routes.add_shape(['to', 'irc-person'], 'to-nick', 'to-nick-handler')
+        self.routes.add_shape(['to', 'irc'],        'pm',      'pm-handler', corr_level=3)
+
+    def test_channel_reply(self):
+        self.assertEqual(self.routes.resolve('to/irc/test/privmsg'.split('/')), (('privmsg', 'privmsg-handler'), None))
+
+    def test_channel_reply_with_id(self):
+        self.assertEqual(self.routes.resolve('to/irc/test/privmsg/0123abcd'.split('/')), (('privmsg', 'privmsg-handler'), '0123abcd'))
+        self.assertEqual(self.routes.resolve('to/irc/test/notice/0123abcd'.split('/')),  (('notice',  'notice-handler'),  '0123abcd'))
+
+    def test_private_reply(self):
+        self.assertEqual(self.routes.resolve('to/irc/\\flok'.split('/')), (('pm', 'pm-handler'), None))
+
+    def test_private_reply_with_id(self):
+        self.assertEqual(self.routes.resolve('to/irc/\\flok/0123abcd'.split('/')), (('pm', 'pm-handler'), '0123abcd'))
+
+    def test_to_nick(self):
+        self.assertEqual(self.routes.resolve('to/irc-person/flok'.split('/')), (('to-nick', 'to-nick-handler'), None))
+
+    def test_unknown(self):
+        self.assertEqual(self.routes.resolve('from/bot/command'.split('/')), (None, None))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+#! /usr/bin/python3
+
+import re
+import threading
+import time
+
+
+# regular expressions that plugins registered to get notified about matching
+# channel messages
+#
+# all patterns are combined into one alternation that is used as a prefilter:
+# most lines match none of them and then only that one regex is evaluated.
+# only when the alternation fires, the individual patterns are checked (more
+# than one plugin can be interested in the same line).
+class trigger_engine:
+    # numbered backreferences (\1), named backreferences ((?P=name)) and
+    # conditionals ((?(1)...)) refer to groups that are renumbered when the
+    # patterns are combined
+    group_references = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]|\(\?P=|\(\?\(')
+
+    def __init__(self):
+        self.lock     = threading.Lock()
+
+        self.triggers = dict()  # cmd -> tuple of pattern-strings
+
+        self.entries  = []      # [cmd, pattern, compiled, hits, match time]
+        self.combined = None
+
+        self.n_lines    = 0
+        self.n_rejected = 0     # lines that were rejected by the prefilter
+        self.match_time = 0.
+
+    # returns False if nothing changed
+    def set_triggers(self, cmd, patterns):
+        patterns = tuple(patterns)
+
+        with self.lock:
+            if self.triggers.get(cmd, ()) == patterns:
+                return False
+
+            if len(patterns) == 0:
+                del self.triggers[cmd]
+
+            else:
+                self.triggers[cmd] = patterns
+
+            self._compile()
+
+        return True
+
+    def remove(self, cmd):
+        return self.set_triggers(cmd, ())
+
+    # invoked with lock held
+    def _compile(self):
+        old_stats = { (e[0], e[1]): (e[3], e[4]) for e in self.entries }
+
+        entries   = []
+
+        for cmd, patterns in self.triggers.items():
+            for pattern in patterns:
+                try:
+                    compiled = re.compile(pattern)
+
+                except re.error as e:
+                    print(f'trigger_engine::_compile: invalid pattern "{pattern}" for {cmd}: {e}')
+
+                    continue
+
+                hits, match_time = old_stats.get((cmd, pattern), (0, 0.))
+
+                entries.append([cmd, pattern, compiled, hits, match_time])
+
+        combined = None
+
+        if any([trigger_engine.group_references.search(e[1]) != None for e in entries]):
+            # the alternation could reject lines a pattern matches on its own
+            print(f'trigger_engine::_compile: patterns with group references, not combining them')
+
+        elif len(entries) > 0:
+            try:
+                combined = re.compile('|'.join(set([f'(?:{e[1]})' for e in entries])))
+
+            except re.error as e:
+                # e.g. patterns with global flags; check them all individually then
+                print(f'trigger_engine::_compile: cannot combine patterns: {e}')
+
+        self.entries  = entries
+        self.combined = combined
+
+    # returns [(cmd, pattern, match object), ...]
+    def match(self, text):
+        with self.lock:
+            entries  = self.entries
+            combined = self.combined
+
+        if len(entries) == 0:
+            return []
+
+        start = time.time()
+
+        out   = []
+
+        hits  = []  # (entry, matched, took)
+
+        if combined != None and combined.search(text) == None:
+            rejected = True
+
+        else:
+            rejected = False
+
+            for entry in entries:
+                entry_start = time.time()
+
+                m = entry[2].search(text)
+
+                hits.append((entry, m != None, time.time() - entry_start))
+
+                if m != None:
+                    out.append((entry[0], entry[1], m))
+
+        with self.lock:
+            for entry, matched, took in hits:
+                entry[3] += matched
+                entry[4] += took
+
+            self.n_lines    += 1
+            self.n_rejected += rejected
+            self.match_time += time.time() - start
+
+        return out
+
+    def get_stats(self):
+        with self.lock:
+            out = dict()
+            out['lines']         = self.n_lines
+            out['prefiltered']   = self.n_rejected
+            out['match_time_ms'] = self.match_time * 1000.
+            out['combined']      = self.combined != None
+            out['patterns']      = [{ 'cmd': e[0], 'pattern': e[1], 'hits': e[3], 'match_time_ms': e[4] * 1000. } for e in self.entries]
+
+            return out